@@ -0,0 +1,200 @@
+"""
+End-to-end throughput benchmark with local stand-ins for every external service.
+
+Drives the real orchestrator and worker routes through Flask's test client,
+with Cloud Tasks, the LLM gateway, Gmail and Neon replaced by the stand-ins in
+benchmarks.standins, then reports newsletters/sec, per-stage p50/p99 and peak
+RSS, plus a cold import profile of the app and of the dependencies it defers
+to first use.
+
+Usage:
+    python -m benchmarks.e2e --users 500 --emails 40 --llm-latency 0.5
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import standins
+from tests.fakes import FakeSMTPServer
+
+# Heavy dependencies the app imports on first use rather than at startup
+DEFERRED_IMPORTS = ["openai", "reportlab.platypus", "psycopg_pool", "google.cloud.tasks_v2", "google.cloud.storage"]
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def peak_rss_mb():
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def import_profile(module, role="all"):
+    """
+    Import a module in a fresh interpreter with -X importtime.
+
+    Returns:
+        tuple: (cumulative seconds, [(direct import, seconds)] slowest first), or None if the import failed
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=root, env={**os.environ, "DUW_ROLE": role}, capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        return None
+    total = 0.0
+    children = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        seconds = int(cumulative) / 1e6
+        if name.strip() == module and name.startswith(' ' + module):
+            total = seconds
+        elif name.startswith('   ') and not name.startswith('    '):
+            children.append((name.strip(), seconds))
+    return total, sorted(children, key=lambda child: child[1], reverse=True)
+
+
+def print_import_profile(top=5):
+    print(f"{'cold import':<24}{'seconds':>9}  slowest direct imports")
+    for role in ("orchestrator", "worker"):
+        profile = import_profile('main', role)
+        if profile:
+            total, children = profile
+            slowest = ', '.join(f"{name} {seconds:.3f}" for name, seconds in children[:top])
+            print(f"{'main (' + role + ')':<24}{total:>9.3f}  {slowest}")
+    for module in DEFERRED_IMPORTS:
+        profile = import_profile(module)
+        print(f"{module:<24}{profile[0]:>9.3f}  deferred to first use" if profile else f"{module:<24}{'n/a':>9}  not installed")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--emails', type=int, default=30)
+    parser.add_argument('--tickers', type=int, default=100, help="size of the ticker universe")
+    parser.add_argument('--holdings', type=int, default=5, help="tickers per portfolio")
+    parser.add_argument('--workers', type=int, default=8, help="worker tasks delivered in parallel, like Cloud Tasks dispatch concurrency")
+    parser.add_argument('--llm-latency', type=float, default=0.2)
+    parser.add_argument('--llm-error-rate', type=float, default=0.0)
+    parser.add_argument('--llm-rate-limit', type=int, default=0, help="requests per minute the LLM stand-in accepts before answering 429")
+    parser.add_argument('--client-rpm', type=int, default=0, help="requests per minute the client-side scheduler allows (LLM_REQUESTS_PER_MINUTE)")
+    parser.add_argument('--smtp-latency', type=float, default=0.01)
+    parser.add_argument('--smtp-connect-latency', type=float, default=0.2)
+    parser.add_argument('--smtp-error-rate', type=float, default=0.0)
+    parser.add_argument('--smtp-server', action='store_true', help="send through the real GmailSender to a local SMTP stand-in instead of replacing the sender")
+    parser.add_argument('--smtp-drop-every', type=int, default=0, help="with --smtp-server, hang up each session after this many messages")
+    parser.add_argument('--tasks-latency', type=float, default=0.02)
+    parser.add_argument('--tasks-error-rate', type=float, default=0.0)
+    parser.add_argument('--db-latency', type=float, default=0.3)
+    parser.add_argument('--extraction', action='store_true', help="run the per-story map phase")
+    parser.add_argument('--content-store', action='store_true', help="reference the corpus from a local content store instead of inlining stories")
+    parser.add_argument('--format', choices=["pdf", "html"], default="pdf", help="delivery format for the run")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-import-profile', action='store_true', help="skip the cold import profile")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    import main as app_module
+    from services import gmail, ledger, llm
+    from services.storage import LocalContentStore
+    from utils import metrics
+
+    tickers = standins.synthetic_tickers(args.tickers, args.seed)
+    emails = standins.synthetic_emails(args.emails, tickers, args.seed)
+    portfolios = standins.synthetic_portfolios(args.users, tickers, args.holdings, args.seed)
+
+    llm_client = standins.StandInLLMClient(args.llm_latency, args.llm_error_rate, args.seed, args.llm_rate_limit)
+    if args.smtp_server:
+        smtp_server = FakeSMTPServer(args.smtp_latency, args.smtp_error_rate, args.seed, args.smtp_drop_every)
+        sender = gmail.GmailSender(user=None, password=None, host=smtp_server.host, port=smtp_server.port, use_ssl=False)
+    else:
+        smtp_server = None
+        sender = standins.StandInSender(args.smtp_latency, args.smtp_error_rate, args.seed, args.smtp_connect_latency)
+    dispatcher = standins.StandInDispatcher(args.tasks_latency, args.tasks_error_rate, args.seed)
+    database = standins.StandInPortfolios(portfolios, args.db_latency, seed=args.seed)
+
+    llm.create_openai_client = lambda: llm_client
+    llm._rate_limiter = llm.RateLimiter(args.client_rpm, 0)
+    llm._completion_cache = llm.MemoryCompletionCache()
+    # A fresh cache and ledger, so nothing from an earlier benchmark run is reused
+    ledger._ledger = ledger.SQLiteLedger(os.path.join(tempfile.mkdtemp(prefix="duw-bench-"), "ledger.sqlite3"))
+    # Every simulated worker shares that ledger, so old tasks are safe to run
+    app_module.TASK_MAX_AGE_MS = 0
+    app_module.get_sender = lambda: sender
+    app_module.task_dispatcher = dispatcher
+    app_module.load_portfolios = database
+    app_module.STORY_EXTRACTION = args.extraction
+    app_module.content_store = LocalContentStore(tempfile.mkdtemp(prefix="duw-bench-")) if args.content_store else None
+    metrics.reset()
+
+    client = app_module.app.test_client()
+    start = time.perf_counter()
+
+    response = client.post('/generate-newsletters', json={"emails": emails, "format": args.format})
+    orchestrator_seconds = time.perf_counter() - start
+    summary = response.get_json()
+
+    def deliver(task):
+        # Each thread gets its own client, as concurrent Cloud Tasks deliveries would
+        worker_response = app_module.app.test_client().post('/worker', json=task)
+        return worker_response.status_code, worker_response.get_json(silent=True)
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        responses = list(pool.map(deliver, dispatcher.tasks))
+    total_seconds = time.perf_counter() - start
+
+    results = [result for _, body in responses if body for result in body.get('results', [])]
+    sent = sum(result['status'] == 'sent' for result in results)
+    failed = sum(result['status'] == 'failed' for result in results)
+    skipped = sum(result['status'] == 'skipped' for result in results)
+    dropped_tasks = sum(body is None for _, body in responses)
+
+    print(f"users {args.users}  emails {args.emails}  distinct newsletters {summary.get('newsletters')}  unaffected users {summary.get('unaffected')}  tasks {len(dispatcher.tasks)}")
+    print(f"orchestrator  {orchestrator_seconds:.2f}s  status {response.status_code}")
+    print(f"total         {total_seconds:.2f}s  sent {sent}  failed {failed}  skipped {skipped}  dropped tasks {dropped_tasks}")
+    print(f"throughput    {sent / total_seconds:.1f} newsletters/sec")
+    print(f"llm calls     {llm_client.calls}  ({llm_client.errors} injected errors, {llm_client.rate_limited} rate limited)")
+    hits = metrics.total("llm_cache_requests_total", {"result": "hit"})
+    misses = metrics.total("llm_cache_requests_total", {"result": "miss"})
+    print(f"llm cache     {hits} hits  {misses} misses")
+    if smtp_server is not None:
+        print(f"smtp          {smtp_server.sessions} sessions  {len(smtp_server.received)} messages received")
+        sender.close()
+        smtp_server.close()
+    print(f"peak rss      {peak_rss_mb():.1f} MB")
+    print()
+    print(f"{'stage':<18}{'count':>7}{'p50 (s)':>10}{'p99 (s)':>10}")
+    stages = ["load_portfolios", "extract_stories", "enqueue", "newsletter", "llm_request", "call_llm", "render_pdf", "render_html", "send_email"]
+    for stage in stages:
+        values = metrics.samples("stage_seconds", {"stage": stage})
+        if values:
+            print(f"{stage:<18}{len(values):>7}{percentile(values, 0.5):>10.3f}{percentile(values, 0.99):>10.3f}")
+    queued = [value for priority in (llm.PRIORITY_EXTRACTION, llm.PRIORITY_COMPOSE) for value in metrics.samples("llm_queue_seconds", {"priority": priority})]
+    if queued:
+        print(f"{'llm queue wait':<18}{len(queued):>7}{percentile(queued, 0.5):>10.3f}{percentile(queued, 0.99):>10.3f}")
+
+    if not args.no_import_profile:
+        print()
+        print_import_profile()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Micro-benchmark for PDF rendering throughput.
+
+Renders the sample newsletter repeatedly, first serially in this process and
+then through the batch render pool, and reports pages/sec for each.
+
+Usage:
+    python -m benchmarks.pdf_render [--count 200] [--repeat 3]
+"""
+import argparse
+import re
+import time
+
+from utils import generatepdf
+
+PAGE_PATTERN = re.compile(rb'/Type /Page\b(?!s)')
+
+
+def count_pages(pdf):
+    return len(PAGE_PATTERN.findall(pdf))
+
+
+def measure(label, render, letters):
+    start = time.perf_counter()
+    pdfs = render(letters)
+    seconds = time.perf_counter() - start
+    pages = sum(count_pages(pdf) for pdf in pdfs)
+    print(f"{label:<8} {len(pdfs):>5} newsletters  {pages:>6} pages  {seconds:>7.2f}s  {pages / seconds:>8.1f} pages/sec")
+    return pages / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=200, help="newsletters rendered per run")
+    parser.add_argument('--repeat', type=int, default=3, help="body repetitions, to make multi-page newsletters")
+    args = parser.parse_args()
+
+    sample = generatepdf.SAMPLE_NEWSLETTER
+    letter = {"title": sample["title"], "body": "\n\n".join([sample["body"]] * args.repeat)}
+    letters = [letter] * args.count
+
+    serial = measure("serial", lambda batch: [generatepdf.render_pdf(item) for item in batch], letters)
+    if hasattr(generatepdf, 'render_pdfs'):
+        # Warm the pool up first so process start-up is not counted
+        generatepdf.render_pdfs([letter] * 2)
+        pooled = measure("pool", generatepdf.render_pdfs, letters)
+        print(f"speedup  {pooled / serial:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""
+Local stand-ins for the pipeline's external services, with configurable
+latency and error injection.
+
+Each stand-in mimics the slice of the real client's interface the pipeline
+uses: Cloud Tasks through services.tasks.TaskDispatcher, the OpenAI gateway
+through AsyncOpenAI.chat.completions.create, Gmail through
+GmailSender.send_many, and Neon through load_portfolios(). For real SMTP,
+benchmarks.e2e uses tests.fakes.FakeSMTPServer instead, so the real
+GmailSender's pooling and reconnects can be exercised against it.
+"""
+import asyncio
+import json
+import random
+import re
+import string
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+from services.tasks import InMemoryDispatcher
+from tests.fakes import RateLimitedError
+
+TICKER_LIST_PATTERN = re.compile(r"\[([^\]]*)\]")
+
+
+class InjectedError(Exception):
+    """Failure raised on purpose by a stand-in."""
+
+
+class StandIn:
+    """Shared latency and error injection."""
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def _roll(self):
+        with self._lock:
+            self.calls += 1
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        return failed
+
+
+class StandInDispatcher(InMemoryDispatcher):
+    """Cloud Tasks stand-in: an in-memory queue with enqueue latency and failures."""
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0, **kwargs):
+        super().__init__(**kwargs)
+        self.injector = StandIn(latency, error_rate, seed)
+
+    def _create_task(self, payload, task_id=None):
+        time.sleep(self.injector.latency)
+        if self.injector._roll():
+            raise InjectedError("injected Cloud Tasks failure")
+        return super()._create_task(payload, task_id)
+
+
+class StandInLLMClient(StandIn):
+    """
+    OpenAI gateway stand-in.
+
+    Extraction prompts get back every sentence mentioning one of the requested
+    tickers; composition prompts get back a newsletter section per mentioned
+    ticker. Token usage is estimated from prompt and reply length.
+
+    With requests_per_minute set, calls beyond that many in any sliding minute
+    are rejected with a 429 and a Retry-After hint.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0, requests_per_minute=0):
+        super().__init__(latency, error_rate, seed)
+        self.chat = SimpleNamespace(completions=self)
+        self.requests_per_minute = requests_per_minute
+        self.rate_limited = 0
+        self._accepted = deque()
+
+    def _check_rate_limit(self):
+        if not self.requests_per_minute:
+            return
+        with self._lock:
+            now = time.monotonic()
+            while self._accepted and now - self._accepted[0] >= 60:
+                self._accepted.popleft()
+            if len(self._accepted) >= self.requests_per_minute:
+                self.rate_limited += 1
+                raise RateLimitedError(60 - (now - self._accepted[0]))
+            self._accepted.append(now)
+
+    async def create(self, model, messages, **kwargs):
+        self._check_rate_limit()
+        await asyncio.sleep(self.latency)
+        if self._roll():
+            raise InjectedError("injected LLM failure")
+
+        prompt = messages[0]['content']
+        tickers_match = TICKER_LIST_PATTERN.search(prompt)
+        tickers = re.findall(r"'([^']+)'", tickers_match.group(1)) if tickers_match else []
+        sentences = re.split(r'(?<=[.!?])\s+', prompt)
+
+        if 'pull out every passage' in prompt:
+            reply = {}
+            for ticker in tickers:
+                passages = [sentence for sentence in sentences if re.search(rf'\b{re.escape(ticker)}\b', sentence) and 'TICKER' not in sentence]
+                if passages:
+                    reply[ticker] = passages[:3]
+        else:
+            sections = []
+            for ticker in tickers:
+                passages = [sentence for sentence in sentences if re.search(rf'\b{re.escape(ticker)}\b', sentence)]
+                if passages:
+                    sections.append(f"## {ticker} in the news\n" + ' '.join(passages[:3]))
+            reply = {"title": "Synthetic Market Roundup", "body": "\n\n".join(sections)}
+
+        content = json.dumps(reply)
+        usage = SimpleNamespace(prompt_tokens=len(prompt) // 4, completion_tokens=len(content) // 4, total_tokens=(len(prompt) + len(content)) // 4)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+
+class StandInSender(StandIn):
+    """Gmail stand-in: per-session connect latency plus per-message latency and failures."""
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0, connect_latency=0.0):
+        super().__init__(latency, error_rate, seed)
+        self.connect_latency = connect_latency
+        self.sent = []
+
+    def send_many(self, messages):
+        time.sleep(self.connect_latency)
+        failures = []
+        for msg in messages:
+            time.sleep(self.latency)
+            if self._roll():
+                failures.append((msg, InjectedError("injected SMTP failure")))
+            else:
+                with self._lock:
+                    self.sent.append((msg['To'], len(msg.as_bytes())))
+        return failures
+
+
+class StandInPortfolios(StandIn):
+    """Neon stand-in: returns a fixed list of portfolios after a query latency."""
+
+    def __init__(self, portfolios, latency=0.0, error_rate=0.0, seed=0):
+        super().__init__(latency, error_rate, seed)
+        self.portfolios = portfolios
+
+    def __call__(self):
+        time.sleep(self.latency)
+        if self._roll():
+            return []
+        return self.portfolios
+
+
+def synthetic_tickers(count, seed=0):
+    """
+    Distinct upper-case symbols that will not collide with the built-in alias table.
+    """
+    rng = random.Random(seed)
+    symbols = set()
+    while len(symbols) < count:
+        symbols.add('Q' + ''.join(rng.choice(string.ascii_uppercase) for _ in range(rng.randint(2, 3))))
+    return sorted(symbols)
+
+
+def synthetic_emails(count, tickers, seed=0, paragraphs=6, duplicate_rate=0.1):
+    """
+    Newsletter emails mentioning a few tickers each, with HTML residue, a footer,
+    and some syndicated near-duplicates.
+    """
+    rng = random.Random(seed)
+    filler = "markets rallied as investors weighed earnings guidance rates outlook and sector rotation".split()
+    emails = []
+    for i in range(count):
+        if emails and rng.random() < duplicate_rate:
+            original = rng.choice(emails)
+            emails.append({"from": f"Syndicate {i}", "body": original['body'] + "<p>Reprinted with permission.</p>"})
+            continue
+        parts = []
+        for _ in range(paragraphs):
+            mentioned = rng.sample(tickers, k=min(2, len(tickers)))
+            words = [rng.choice(filler) for _ in range(40)]
+            parts.append(f"<p>{' '.join(mentioned)} moved today. {' '.join(words).capitalize()}.</p>")
+        parts.append("<p>You are receiving this email because you subscribed. Unsubscribe here.</p>")
+        emails.append({"from": f"Publisher {i % 7}", "body": "\n".join(parts)})
+    return emails
+
+
+def synthetic_portfolios(users, tickers, holdings=5, seed=0, shared=0.7, templates=30):
+    """
+    Portfolios where a share of users hold one of a few common model portfolios
+    (the same ETFs and mega-caps) and the rest hold random picks.
+    """
+    rng = random.Random(seed)
+    popular = tickers[:max(holdings, len(tickers) // 5)]
+    model_portfolios = [sorted(rng.sample(popular, k=min(holdings, len(popular)))) for _ in range(templates)]
+    portfolios = []
+    for i in range(users):
+        if rng.random() < shared:
+            chosen = rng.choice(model_portfolios)
+        else:
+            chosen = sorted(rng.sample(tickers, k=min(holdings, len(tickers))))
+        portfolios.append({f"user{i}@example.com": {"Main": list(chosen)}})
+    return portfolios
@@ -3,13 +3,21 @@ import json
 import logging
 import os
 import time
+import uuid
 from datetime import datetime, timezone
-from flask import Flask, request, jsonify
-from utils.generatepdf import generate_pdf
-from google.cloud import tasks_v2
-from services.gmail import send_email_gmail
-from services.llm import call_llm, create_openai_client
-from services.portfolio import fetch_portfolios
+from functools import lru_cache
+from flask import Flask, Response, request, jsonify
+from services.corpus import compact_emails, story_fingerprint
+from services.gmail import build_html_message, build_message, get_sender, is_permanent_failure
+from services.ledger import get_ledger, is_shared_ledger, job_key
+from services.llm import call_llm, extract_story_facts
+from services.portfolio import SubscriberIndex, group_portfolios
+from services.relevance import StoryIndex, format_stories, load_aliases
+from services.snapshot import invalidate_snapshot, load_company_names, load_portfolios
+from services.storage import get_content_store
+from services.tasks import CloudTasksDispatcher
+from utils import eventloop, metrics
+from utils.generatehtml import render_html
 
 # Set up logger
 logging.basicConfig(level=logging.INFO)
@@ -20,67 +28,357 @@ QUEUE_ID = "duw-background-tasks"
 REGION = "us-east1"
 CLOUD_RUN_URL = os.environ.get("WORKER_URL")  
 SERVICE_ACCOUNT_EMAIL = os.environ.get("TASK_SERVICE_ACCOUNT")
+# Off by default: extraction runs inside the synchronous /generate-newsletters request
+STORY_EXTRACTION = os.environ.get("STORY_EXTRACTION", "false").lower() == "true"
+EXTRACTION_CONCURRENCY = int(os.environ.get("EXTRACTION_CONCURRENCY", "8"))
+WORKER_BATCH_SIZE = int(os.environ.get("WORKER_BATCH_SIZE", "10"))
+# Cap on the jobs' JSON size per task, under Cloud Tasks' 1 MB task limit, since jobs can carry their stories inline
+WORKER_BATCH_BYTES = int(os.environ.get("WORKER_BATCH_BYTES", "800000"))
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", "4"))
+# "pdf" attaches a rendered PDF, "html" sends the newsletter inline; runs and users can override it
+DELIVERY_FORMAT = os.environ.get("DELIVERY_FORMAT", "pdf")
+DELIVERY_FORMATS = ("pdf", "html")
+# Only send each recipient the stories they have not been sent before
+INCREMENTAL_NEWSLETTERS = os.environ.get("INCREMENTAL_NEWSLETTERS", "true").lower() == "true"
+# What users whose tickers no story mentions get: "notice" for a static no-news newsletter, or "skip"
+UNAFFECTED_POLICY = os.environ.get("UNAFFECTED_POLICY", "notice")
+NOTICE_BATCH_SIZE = int(os.environ.get("NOTICE_BATCH_SIZE", "500"))
+# Which routes this deployment serves: "orchestrator", "worker", or "all"
+DUW_ROLE = os.environ.get("DUW_ROLE", "all")
+# Tasks older than this are dropped unless a shared ledger can tell what they already delivered; 0 never drops
+TASK_MAX_AGE_MS = int(os.environ.get("TASK_MAX_AGE_MS", "10000"))
 
 
 
-app = Flask(__name__)
+content_store = get_content_store()
+task_dispatcher = None
+# Ticker -> subscribers, kept in step with the portfolio snapshot across runs
+subscriber_index = SubscriberIndex()
 
-async def generate_and_send_single_newsletter(email, portfolio_data, stories):
+
+def get_task_dispatcher():
+    """
+    Return the process-wide Cloud Tasks dispatcher, creating it on first use.
+    
+    Returns:
+        TaskDispatcher: Dispatcher for the worker queue
     """
-    Generate and send newsletter for a single user's portfolio with pre-processed stories.
+    global task_dispatcher
+    if task_dispatcher is None:
+        task_dispatcher = CloudTasksDispatcher(PROJECT_ID, REGION, QUEUE_ID, CLOUD_RUN_URL, SERVICE_ACCOUNT_EMAIL)
+    return task_dispatcher
+
+async def generate_and_send_newsletter(emails, tickers, stories, run_id=None, formats=None, fingerprints=None):
+    """
+    Generate one newsletter for a ticker set and send it to every recipient holding it.
+    
+    The letter is generated once and delivered in each recipient's format: as a
+    PDF attachment, or inline as HTML, which skips PDF rendering entirely.
+    
+    With a run_id, the letter and PDF are saved in the delivery ledger as they
+    are produced, so a retried task resumes from the last completed stage, and
+    each recipient is marked delivered as soon as their email is accepted.
+    Given fingerprints, the stories are also marked seen for each recipient,
+    but only when the letter is complete and has a body, so stories a failed
+    or partial completion left out are sent again next time.
     
     Args:
-        email (str): User's email address
-        portfolio_data (dict): Complete portfolio object with all accounts
+        emails (list): Email addresses of the users sharing this ticker set
+        tickers (list): Unique tickers across all of the users' accounts
         stories (str): Pre-processed stories content
+        run_id (str): Orchestrator run the newsletter belongs to
+        formats (dict): Delivery format per email, DELIVERY_FORMAT for any not listed
+        fingerprints (list): Fingerprints of the stories, to mark seen on delivery
+        
+    Returns:
+        list: One {"email", "status", "error", "retryable"} result per recipient
     """
-    logger.info(f"[LOG] Processing newsletter for {email}")
+    logger.info(f"[LOG] Processing newsletter for {len(emails)} recipients")
     
-    client = create_openai_client()
+    logger.info(f"[LOG] Processing portfolio with {len(tickers)} unique tickers")
     
-    # Extract all tickers from all accounts in the portfolio
-    all_tickers = []
-    for account_name, tickers in portfolio_data.items():
-        all_tickers.extend(tickers)
+    by_format = {}
+    for email in emails:
+        by_format.setdefault((formats or {}).get(email, DELIVERY_FORMAT), []).append(email)
     
-    # Remove duplicates while preserving order
-    unique_tickers = []
-    seen = set()
-    for ticker in all_tickers:
-        if ticker not in seen:
-            unique_tickers.append(ticker)
-            seen.add(ticker)
+    ledger = get_ledger() if run_id else None
+    key = job_key(tickers, stories)
+    # Only complete letters are kept, and a PDF only after its letter
+    cached_letter = await asyncio.to_thread(ledger.get_artifact, run_id, key, "letter") if ledger else None
+    letter = json.loads(cached_letter) if cached_letter is not None else None
+    pdf = None
+    if 'pdf' in by_format and cached_letter is not None:
+        pdf = await asyncio.to_thread(ledger.get_artifact, run_id, key, "pdf")
+        if pdf is not None:
+            logger.info(f"[LOG] Reusing PDF from an earlier attempt of run {run_id}")
     
-    logger.info(f"[LOG] Processing portfolio with {len(unique_tickers)} unique tickers across {len(portfolio_data)} accounts")
+    if letter is not None:
+        logger.info(f"[LOG] Reusing newsletter content from an earlier attempt of run {run_id}")
+    elif stories:
+        letter = await call_llm(tickers, stories)
+        logger.info(f"[LOG] Generated newsletter content")
+    else:
+        # Nothing in today's emails mentions these tickers, so there is nothing to ask the LLM
+        letter = {"title": "", "body": ""}
+        logger.info(f"[LOG] No relevant stories, skipping LLM")
+    # A failed or partial completion should be redone by a retry, not reused
+    complete = not letter.get("incomplete")
+    if ledger and cached_letter is None and complete:
+        await asyncio.to_thread(ledger.put_artifact, run_id, key, "letter", json.dumps(letter).encode())
     
-    letter = await call_llm(unique_tickers, stories, client)
-    logger.info(f"[LOG] Generated newsletter content")
+    results = {}
+    messages = []
+    if 'pdf' in by_format and pdf is None:
+        try:
+            # ReportLab is only needed by workers, so it is imported on first render
+            from utils.generatepdf import submit_render
+            
+            logger.info(f"[LOG] Rendering PDF in memory")
+            with metrics.span("render_pdf"):
+                pdf = await asyncio.wrap_future(submit_render(letter))
+            metrics.observe("pdf_bytes", len(pdf), buckets=metrics.BYTES_BUCKETS)
+            logger.info(f"[LOG] PDF generated successfully ({len(pdf)} bytes)")
+            # Like the letter, a PDF of a failed or partial completion should be regenerated on retry
+            if ledger and complete:
+                await asyncio.to_thread(ledger.put_artifact, run_id, key, "pdf", pdf)
+        except Exception as e:
+            logger.error(f"[ERROR] Failed to generate PDF: {e}")
+            for email in by_format['pdf']:
+                # Rendering the same letter again would fail the same way
+                results[email] = {"email": email, "status": "failed", "error": f"PDF generation failed: {e}", "retryable": False}
+    if pdf is not None:
+        messages.extend(build_message(pdf, email) for email in by_format.get('pdf', []))
+    if 'html' in by_format:
+        # Cheap enough to redo on a retry, so the HTML is not kept in the ledger
+        with metrics.span("render_html"):
+            html, text = render_html(letter)
+        metrics.observe("html_bytes", len(html), buckets=metrics.BYTES_BUCKETS)
+        messages.extend(build_html_message(html, text, email) for email in by_format['html'])
     
-    tmp_path = "/tmp/newsletter.pdf"
+    # Deliver to the whole group over one pooled SMTP session
+    logger.info(f"[LOG] Sending newsletter to {len(messages)} recipients")
+    with metrics.span("send_email", recipients=len(messages)):
+        failures = await asyncio.to_thread(get_sender().send_many, messages) if messages else []
+    metrics.inc("emails_sent_total", len(messages) - len(failures), labels={"status": "sent"})
+    metrics.inc("emails_sent_total", len(failures), labels={"status": "failed"})
+    if failures:
+        logger.error(f"[ERROR] Failed to send email to {len(failures)} of {len(emails)} recipients")
     
-    try:
-        logger.info(f"[LOG] Generating PDF at {tmp_path}")
-        generate_pdf(letter, tmp_path)
-        logger.info(f"[LOG] PDF generated successfully")
-    except Exception as e:
-        logger.error(f"[ERROR] Failed to generate PDF: {e}")
-        return
+    for msg, error in failures:
+        results[msg['To']] = {"email": msg['To'], "status": "failed", "error": str(error), "retryable": not is_permanent_failure(error)}
+    covered = fingerprints if ledger and complete and letter.get("body") else None
+    for msg in messages:
+        if msg['To'] not in results:
+            results[msg['To']] = {"email": msg['To'], "status": "sent"}
+            if ledger:
+                await asyncio.to_thread(ledger.mark_delivered, run_id, msg['To'])
+            if covered:
+                await asyncio.to_thread(ledger.mark_seen, msg['To'], covered)
     
-    try:
-        logger.info(f"[LOG] Sending email with PDF attachment to {email}")
-        send_email_gmail(tmp_path, email)
-        logger.info(f"[LOG] Email sent successfully to {email}")
-    except Exception as e:
-        logger.error(f"[ERROR] Failed to send email to {email}: {e}")
-        return
+    logger.info(f"[LOG] Newsletter processing completed for {len(emails)} recipients")
+    return [results[email] for email in emails]
+
+def item_fingerprints(items):
+    """
+    Fingerprints of the source stories behind items, whichever passages they carry.
+    
+    Args:
+        items (list): {"author", "body", "fingerprint"} stories from StoryIndex.select()
+        
+    Returns:
+        list: One fingerprint per item
+    """
+    # Items queued before select() added fingerprints only have their body to go on
+    return [item.get('fingerprint') or story_fingerprint(item['body']) for item in items]
+
+def pack_jobs(jobs, max_jobs=None, max_bytes=None):
+    """
+    Split jobs into task-sized batches, bounded by job count and JSON size.
+    
+    A job larger than max_bytes on its own still gets a batch of its own.
+    
+    Args:
+        jobs (list): Jobs in the order they should be sent
+        max_jobs (int): Jobs per batch, WORKER_BATCH_SIZE by default
+        max_bytes (int): JSON bytes per batch, WORKER_BATCH_BYTES by default
+        
+    Returns:
+        list: Lists of jobs
+    """
+    max_jobs = max_jobs or WORKER_BATCH_SIZE
+    max_bytes = max_bytes or WORKER_BATCH_BYTES
+    batches = []
+    batch, size = [], 0
+    for job in jobs:
+        job_bytes = len(json.dumps(job).encode())
+        if batch and (len(batch) >= max_jobs or size + job_bytes > max_bytes):
+            batches.append(batch)
+            batch, size = [], 0
+        if job_bytes > max_bytes:
+            logger.warning(f"[WARN] Job for {len(job['emails'])} recipients is {job_bytes} bytes, over the {max_bytes} byte task budget")
+        batch.append(job)
+        size += job_bytes
+    if batch:
+        batches.append(batch)
+    return batches
+
+def split_by_unseen(ledger, emails, items):
+    """
+    Group recipients by which of the stories they have not been sent before.
+    
+    Args:
+        ledger (DeliveryLedger): Ledger holding each recipient's delivered story fingerprints
+        emails (list): Recipients sharing a ticker set
+        items (list): The ticker set's relevant {"author", "body", "fingerprint"} stories
+        
+    Returns:
+        list: (emails, unseen items) pairs, one per distinct unseen set
+    """
+    fingerprints = item_fingerprints(items)
+    groups = {}
+    for email in emails:
+        seen = ledger.seen_stories(email)
+        unseen = tuple(i for i, fingerprint in enumerate(fingerprints) if fingerprint not in seen)
+        groups.setdefault(unseen, []).append(email)
+    return [(group_emails, [items[i] for i in unseen]) for unseen, group_emails in groups.items()]
+
+async def process_jobs(jobs, run_id=None, corpus_key=None, delivery_format=DELIVERY_FORMAT):
+    """
+    Process a batch of newsletters concurrently, at most WORKER_CONCURRENCY at a time.
+    
+    With INCREMENTAL_NEWSLETTERS, each recipient only gets the relevant stories
+    they have not been sent in an earlier newsletter. Recipients who were
+    already sent every relevant story are treated like users no story
+    mentions: they get the static notice, or nothing, per UNAFFECTED_POLICY.
     
-    logger.info(f"[LOG] Newsletter processing completed successfully for {email}")
+    Args:
+        jobs (list): {"emails", "tickers"} dicts, with "items" (or preformatted "stories")
+            unless corpus_key is given, and "formats" for recipients who want another
+            format than the run's. Jobs with "notice" get the static no-news newsletter.
+        run_id (str): Orchestrator run the batch belongs to
+        corpus_key (str): Content store key of the run's corpus, if stories are not inline
+        delivery_format (str): The run's delivery format
+        
+    Returns:
+        list: One {"email", "status", "error"} result per recipient across the batch
+    """
+    semaphore = asyncio.Semaphore(WORKER_CONCURRENCY)
+    ledger = get_ledger() if run_id else None
+    
+    async def send(emails, tickers, items, formats):
+        stories = format_stories(items)
+        fingerprints = item_fingerprints(items) if INCREMENTAL_NEWSLETTERS else None
+        async with semaphore:
+            with metrics.span("newsletter", recipients=len(emails)):
+                return await generate_and_send_newsletter(emails, tickers, stories, run_id, formats, fingerprints)
+    
+    async def process(job):
+        emails = job.get('emails')
+        tickers = job.get('tickers')
+        notice = job.get('notice', False)
+        if not emails or not (tickers or notice) or (job.get('items') is None and job.get('stories') is None and not corpus_key and not notice):
+            logger.warning("[WARN] Dropped job with incomplete payload.")
+            return [{"email": email, "status": "dropped"} for email in emails or []]
+        
+        # A retried or duplicated task skips recipients the run already delivered to
+        if ledger:
+            delivered = await asyncio.to_thread(lambda: {email for email in emails if ledger.is_delivered(run_id, email)})
+        else:
+            delivered = set()
+        pending = [email for email in emails if email not in delivered]
+        already_sent = [{"email": email, "status": "sent"} for email in emails if email in delivered]
+        if not pending:
+            return already_sent
+        
+        try:
+            formats = {email: job.get('formats', {}).get(email, delivery_format) for email in pending}
+            if notice:
+                # Nothing today mentions these users' tickers; the empty letter renders as a static notice
+                return already_sent + await send(pending, [], [], formats)
+            if corpus_key:
+                story_index, excerpts = await asyncio.to_thread(load_corpus, corpus_key)
+                items = story_index.select(tickers, excerpts)
+            else:
+                items = job.get('items')
+            
+            if items is None:
+                # Tasks queued before stories were sent as items carry them preformatted
+                async with semaphore:
+                    with metrics.span("newsletter", recipients=len(pending)):
+                        results = await generate_and_send_newsletter(pending, tickers, job['stories'], run_id, formats)
+            elif ledger and INCREMENTAL_NEWSLETTERS and items:
+                groups = await asyncio.to_thread(split_by_unseen, ledger, pending, items)
+                caught_up = [email for group_emails, unseen in groups if not unseen for email in group_emails]
+                sends = [send(group_emails, tickers, unseen, formats) for group_emails, unseen in groups if unseen]
+                results = []
+                if caught_up and UNAFFECTED_POLICY == "notice":
+                    # Nothing new about their tickers, the same as for users no story mentions
+                    logger.info(f"[LOG] Sending the notice to {len(caught_up)} recipients who were already sent every relevant story")
+                    sends.append(send(caught_up, [], [], formats))
+                elif caught_up:
+                    logger.info(f"[LOG] Skipping {len(caught_up)} recipients who were already sent every relevant story")
+                    metrics.inc("newsletters_skipped_total", len(caught_up), labels={"reason": "no_new_stories"})
+                    results = [{"email": email, "status": "skipped", "reason": "no new stories"} for email in caught_up]
+                batches = await asyncio.gather(*sends)
+                results += [result for batch in batches for result in batch]
+            else:
+                results = await send(pending, tickers, items, formats)
+        except Exception as e:
+            logger.error(f"[ERROR] Newsletter failed for {len(pending)} recipients: {e}", exc_info=True)
+            results = [{"email": email, "status": "failed", "error": str(e), "retryable": True} for email in pending]
+        return already_sent + results
+    
+    batches = await asyncio.gather(*(process(job) for job in jobs))
+    return [result for batch in batches for result in batch]
+
+async def extract_story_excerpts(story_index, tickers):
+    """
+    Map phase: extract per-ticker excerpts from every story, concurrently and once per run.
+    
+    Args:
+        story_index (StoryIndex): Index over the day's emails
+        tickers (list): Every ticker held by at least one user
+        
+    Returns:
+        dict: Story position mapped to {ticker: [excerpt]}. Stories whose extraction
+        failed are left out so workers fall back to their full text.
+    """
+    semaphore = asyncio.Semaphore(EXTRACTION_CONCURRENCY)
+    candidates = story_index.tickers_by_story(tickers)
+    
+    async def extract(position, story_tickers):
+        story = story_index.stories[position]
+        async with semaphore:
+            facts = await extract_story_facts(story['author'], story['body'], story_tickers)
+        return position, facts
+    
+    results = await asyncio.gather(*(extract(position, story_tickers) for position, story_tickers in candidates.items()))
+    excerpts = {position: facts for position, facts in results if facts is not None}
+    logger.info(f"[LOG] Extracted excerpts from {len(excerpts)} of {len(candidates)} candidate stories")
+    return excerpts
+
+@lru_cache(maxsize=8)
+def load_corpus(corpus_key):
+    """
+    Fetch a run's story corpus from the content store and index it.
+    
+    Keys are content hashes, so a cached corpus never goes stale and every task
+    of the run after the first on this instance skips the fetch and parse.
+    
+    Args:
+        corpus_key (str): Content store key written by the orchestrator
+        
+    Returns:
+        tuple: (StoryIndex, excerpts or None)
+    """
+    corpus = json.loads(content_store.get(corpus_key))
+    logger.info(f"[LOG] Loaded corpus {corpus_key} with {len(corpus['emails'])} stories")
+    return StoryIndex.from_corpus(corpus)
 
-@app.route("/generate-newsletters", methods=["POST"])
 def generate_newsletters_orchestrator():
     """
     Receives emails from Google Apps Script, prepares shared content,
-    and creates a Cloud Task for each portfolio.
+    and creates a Cloud Task for each distinct set of portfolio tickers.
     """
     logger.info("[LOG] Orchestrator triggered by Apps Script...")
     
@@ -90,51 +388,122 @@ def generate_newsletters_orchestrator():
         emails = request_data.get("emails", [])
         if not emails:
             return jsonify({"status": "error", "message": "No emails provided"}), 400
+        # Optional delivery format for the whole run, and per-recipient overrides
+        delivery_format = request_data.get("format", DELIVERY_FORMAT)
+        formats = request_data.get("formats") or {}
     except Exception as e:
         logger.error(f"[ERROR] Failed to parse JSON from request: {e}")
         return jsonify({"status": "error", "message": "Invalid JSON"}), 400
+    if not isinstance(formats, dict) or any(value not in DELIVERY_FORMATS for value in [delivery_format, *formats.values()]):
+        return jsonify({"status": "error", "message": f"Delivery formats must be one of {', '.join(DELIVERY_FORMATS)}"}), 400
 
-    stories = ''
-    for email in emails:
-        stories += f"Article by: {email.get('from', 'Unknown')}\n Story: {email.get('body', '')}\n\n"
-    
-    logger.info(f"[LOG] Aggregated {len(emails)} emails into shared stories content.")
+    # Strip HTML and footers and drop syndicated duplicates before anything reads the stories
+    emails = compact_emails(emails)
 
     # 2. Fetch all portfolios from your database
-    portfolios = fetch_portfolios()
-    logger.info(f"[LOG] Found {len(portfolios)} portfolios to process.")
+    # Users holding the same tickers get the same newsletter, so generate it once.
+    # Portfolios come from the cached snapshot unless the database has changed since.
+    with metrics.span("load_portfolios"):
+        portfolios = load_portfolios()
+        changed = subscriber_index.sync(portfolios)
+    logger.info(f"[LOG] Subscriber index updated for {changed} of {len(portfolios)} users.")
 
-    # 3. Create one task per portfolio, including the shared stories
-    client = tasks_v2.CloudTasksClient()
-    parent = client.queue_path(PROJECT_ID, REGION, QUEUE_ID)
+    # Stories can name the company instead of the symbol, so index them with the held companies' names
+    story_index = StoryIndex(emails, load_aliases(load_company_names()))
+    logger.info(f"[LOG] Indexed {len(emails)} emails for ticker relevance.")
 
-    for user_portfolio in portfolios:
-        # Extract email and portfolio from the user_portfolio dict
-        email = list(user_portfolio.keys())[0]
-        portfolio = user_portfolio[email]
-        
+    # Only users holding a ticker that today's stories mention (by symbol or company name) need a newsletter
+    detected = sorted({ticker for tickers in story_index.tickers_by_story(subscriber_index.tickers()).values() for ticker in tickers})
+    affected = subscriber_index.subscribers(detected)
+    unaffected = sorted(subscriber_index.emails() - affected)
+    groups = group_portfolios(user for user in portfolios if not affected.isdisjoint(user))
+    recipients = sum(len(group['emails']) for group in groups)
+    logger.info(f"[LOG] Stories mention {len(detected)} held tickers; grouped {recipients} affected portfolios into {len(groups)} distinct ticker sets.")
+
+    # Read each story once up front, so every newsletter is composed from short excerpts
+    excerpts = None
+    if STORY_EXTRACTION and detected:
+        with metrics.span("extract_stories", stories=len(emails)):
+            excerpts = eventloop.run(extract_story_excerpts(story_index, detected))
+
+    # Write the corpus once and have tasks reference it, instead of copying it into every task
+    corpus_key = None
+    if content_store is not None:
+        corpus = json.dumps(story_index.to_corpus(excerpts), sort_keys=True).encode()
+        corpus_key = content_store.put(corpus)
+        logger.info(f"[LOG] Stored {len(corpus)} byte corpus as {corpus_key}")
+
+    # 3. Build one job per ticker set, with only the stories that mention it unless the corpus is shared
+    jobs = []
+    for group in groups:
+        job = {
+            'emails': group['emails'],
+            'tickers': group['tickers'],  # Unique tickers shared by every recipient in the group
+        }
+        if not corpus_key:
+            job['items'] = story_index.select(group['tickers'], excerpts)  # Empty when no story matches
+        overrides = {email: formats[email] for email in group['emails'] if formats.get(email, delivery_format) != delivery_format}
+        if overrides:
+            job['formats'] = overrides
+        jobs.append(job)
+
+    # Everyone else gets the same static notice, sent in large batches without an LLM call, or nothing
+    if unaffected and UNAFFECTED_POLICY == "notice":
+        for start in range(0, len(unaffected), NOTICE_BATCH_SIZE):
+            notice_emails = unaffected[start:start + NOTICE_BATCH_SIZE]
+            job = {'emails': notice_emails, 'tickers': [], 'notice': True}
+            overrides = {email: formats[email] for email in notice_emails if formats.get(email, delivery_format) != delivery_format}
+            if overrides:
+                job['formats'] = overrides
+            jobs.append(job)
+        recipients += len(unaffected)
+    elif unaffected:
+        logger.info(f"[LOG] Skipping {len(unaffected)} users with no relevant stories")
+        metrics.inc("newsletters_skipped_total", len(unaffected), labels={"reason": "no_relevant_stories"})
+
+    # Pack several jobs into each task to spread the fixed per-task cost
+    run_id = uuid.uuid4().hex
+    payloads = []
+    for batch in pack_jobs(jobs):
         payload = {
-            'email': email,
-            'tickers': portfolio,  # This is now the entire portfolio object with all accounts
-            'stories': stories,  # Include the same stories content in each task
+            'run_id': run_id,
+            'format': delivery_format,
+            'jobs': batch,
             'timestamp': int(time.time() * 1000)
         }
-        
-        task = {
-            "http_request": {
-                "http_method": tasks_v2.HttpMethod.POST,
-                "url": CLOUD_RUN_URL,  # URL to your /worker endpoint
-                "headers": {"Content-Type": "application/json"},
-                "body": json.dumps(payload).encode(),
-                "oidc_token": {"service_account_email": SERVICE_ACCOUNT_EMAIL}
-            }
-        }
-        response = client.create_task(request={"parent": parent, "task": task})
-        logger.info(f"[LOG] Created task {response.name} for portfolio")
+        if corpus_key:
+            payload['corpus_key'] = corpus_key  # The worker selects the relevant stories itself
+        payloads.append(payload)
+
+    # 4. Enqueue the tasks concurrently, reporting any that could not be created
+    with metrics.span("enqueue", tasks=len(payloads)):
+        report = get_task_dispatcher().dispatch(payloads)
+    if report['failed']:
+        logger.error(f"[ERROR] Failed to enqueue {len(report['failed'])} of {len(payloads)} tasks")
+        return jsonify({
+            "status": "partial",
+            "run_id": run_id,
+            "count": report['created'],
+            "recipients": recipients,
+            "unaffected": len(unaffected),
+            "failed": report['failed'],
+        }), 207
 
-    return jsonify({"status": "tasks created", "count": len(portfolios)}), 200
+    return jsonify({"status": "tasks created", "run_id": run_id, "count": report['created'], "newsletters": len(jobs), "recipients": recipients, "unaffected": len(unaffected)}), 200
+
+def invalidate_portfolios():
+    """
+    Force the next orchestrator run to rebuild the portfolio snapshot from the database.
+    """
+    invalidate_snapshot()
+    return jsonify({"status": "invalidated"}), 200
+
+def metrics_endpoint():
+    """
+    Per-stage latency, LLM token and retry counters, and size histograms in Prometheus text format.
+    """
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
 
-@app.route("/worker", methods=["POST"])
 def worker():
     logger.info("[LOG] /worker endpoint triggered")
     try:
@@ -143,37 +512,90 @@ def worker():
             logger.warning("[WARN] Dropped Cloud Task with no payload (likely a retry)")
             return "Dropped empty payload", 200
 
-        # Check for timestamp and age validation
-        timestamp = payload.get('timestamp')
-        if not timestamp:
-            logger.warning("[WARN] Dropped Cloud Task with no timestamp (likely a retry)")
-            return "Dropped empty payload", 200 
-        now_ms = int(datetime.now(tz=timezone.utc).timestamp() * 1000)
-        age_ms = now_ms - timestamp
-        logger.info(f'[LOG] Age of instance is {age_ms} ms')
-        MAX_AGE_MS = 10000  
-        if age_ms > MAX_AGE_MS:
-            logger.info(f"[LOG] Dropping old task, age: {age_ms}ms")
-            return "DROPPED_OLD_TASK", 200
-        
-        # Unpack the email, tickers, and stories from the payload
-        email = payload.get('email')
-        tickers_data = payload.get('tickers')
-        stories_content = payload.get('stories')
+        # Tasks created before batching carry a single job at the top level
+        jobs = payload.get('jobs') or [payload]
+        run_id = payload.get('run_id')
 
-        if not email or not tickers_data or not stories_content:
-            logger.warning("[WARN] Dropped task with incomplete payload.")
-            return "Incomplete payload", 200
+        # With a shared ledger, retries are safe to run whatever their age: it skips
+        # recipients the run already reached and reuses finished artifacts. A local
+        # ledger only knows this instance's deliveries, and tasks without a run_id
+        # are not recorded at all, so old tasks are dropped rather than resent.
+        timestamp = payload.get('timestamp')
+        if timestamp:
+            now_ms = int(datetime.now(tz=timezone.utc).timestamp() * 1000)
+            age_ms = now_ms - timestamp
+            logger.info(f'[LOG] Age of task is {age_ms} ms')
+            if TASK_MAX_AGE_MS and age_ms > TASK_MAX_AGE_MS and not (run_id and is_shared_ledger()):
+                logger.info(f"[LOG] Dropping old task, age: {age_ms}ms")
+                return "DROPPED_OLD_TASK", 200
+        corpus_key = payload.get('corpus_key')
+        delivery_format = payload.get('format', DELIVERY_FORMAT)
 
-        logger.info(f"[LOG] Processing portfolio for {email} with pre-processed stories")
+        logger.info(f"[LOG] Processing batch of {len(jobs)} newsletters for run {run_id}")
 
-        # Run the async function with the unpacked data
-        asyncio.run(generate_and_send_single_newsletter(email, tickers_data, stories_content))
-        return jsonify({"status": "completed"}), 200
+        # Run on the shared event loop so concurrent requests share the LLM client
+        results = eventloop.run(process_jobs(jobs, run_id, corpus_key, delivery_format))
+        failed = [result for result in results if result['status'] == 'failed']
+        if not failed:
+            return jsonify({"status": "completed", "results": results}), 200
+        retryable = [result for result in failed if result.get('retryable', True)]
+        logger.error(f"[ERROR] {len(failed)} of {len(results)} recipients failed, {len(retryable)} of them transiently")
+        # A non-2xx response makes Cloud Tasks retry the whole task. Only a shared ledger
+        # lets the retry skip the recipients already reached, wherever it lands, and
+        # permanent rejections would only fail again.
+        if retryable and run_id and is_shared_ledger():
+            return jsonify({"status": "partial", "results": results}), 500
+        return jsonify({"status": "partial", "results": results}), 200
     except Exception as e:
         logger.error(f"[ERROR] Worker failed: {e}", exc_info=True)
         return jsonify({"status": "error", "message": str(e)}), 500
 
+def create_app(role=DUW_ROLE):
+    """
+    Build a Flask app serving one deployment role.
+    
+    The orchestrator and worker run as separate Cloud Run services; giving each
+    only its own routes keeps it from ever loading the other's dependencies,
+    which are imported on first use.
+    
+    Args:
+        role (str): "orchestrator", "worker", or "all" for both
+        
+    Returns:
+        Flask: Configured app
+    """
+    if role not in ("orchestrator", "worker", "all"):
+        raise ValueError(f"Unknown role {role!r}, expected orchestrator, worker or all")
+    
+    app = Flask(__name__)
+    app.add_url_rule("/metrics", view_func=metrics_endpoint, methods=["GET"])
+    if role in ("orchestrator", "all"):
+        app.add_url_rule("/generate-newsletters", view_func=generate_newsletters_orchestrator, methods=["POST"])
+        app.add_url_rule("/invalidate-portfolios", view_func=invalidate_portfolios, methods=["POST"])
+    if role in ("worker", "all"):
+        app.add_url_rule("/worker", view_func=worker, methods=["POST"])
+        if not is_shared_ledger():
+            logger.warning(
+                "[WARN] Delivery ledger is local to this instance; retries landing elsewhere would resend, "
+                f"so tasks older than {TASK_MAX_AGE_MS} ms are dropped. Set DELIVERY_LEDGER_URL to a gs:// location to share it"
+            )
+    logger.info(f"[LOG] Created app for role {role}")
+    return app
+
+def create_orchestrator_app():
+    """
+    App with only the orchestrator routes, e.g. `hypercorn "main:create_orchestrator_app()"`.
+    """
+    return create_app("orchestrator")
+
+def create_worker_app():
+    """
+    App with only the worker route, e.g. `hypercorn "main:create_worker_app()"`.
+    """
+    return create_app("worker")
+
+app = create_app()
+
 
 if __name__ == "__main__":
     app.run(debug=True, port=8080)
@@ -0,0 +1,258 @@
+import hashlib
+import html
+import logging
+import os
+import re
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Environment variables
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "100000"))
+
+SHINGLE_SIZE = 5
+MINHASH_PERMUTATIONS = 64
+MINHASH_PRIME = (1 << 61) - 1
+# Fixed seeds so signatures are comparable across processes and runs
+MINHASH_SEEDS = [
+    (int.from_bytes(hashlib.sha256(f"a{i}".encode()).digest()[:8], 'big') % MINHASH_PRIME or 1,
+     int.from_bytes(hashlib.sha256(f"b{i}".encode()).digest()[:8], 'big') % MINHASH_PRIME)
+    for i in range(MINHASH_PERMUTATIONS)
+]
+
+HIDDEN_BLOCK_PATTERN = re.compile(r'<(script|style|head)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+BLOCK_TAG_PATTERN = re.compile(r'<\s*(br|/p|/div|/tr|/li|/h[1-6])\b[^>]*>', re.IGNORECASE)
+TAG_PATTERN = re.compile(r'<[^>]+>')
+URL_PATTERN = re.compile(r'https?://\S+')
+WORD_PATTERN = re.compile(r'\w+')
+STORY_BOUNDARY_PATTERN = re.compile(r'(?m)^(?=Article by: )')
+
+# Newsletter chrome that never appears in news, dropped wherever it is
+CHROME_PATTERN = re.compile(
+    r'unsubscribe|view (this email )?in (your )?browser|manage (your )?(email )?preferences|'
+    r'you are receiving this|you received this|forwarded this email',
+    re.IGNORECASE,
+)
+# Footer phrases that also turn up in stories ("Meta updated its privacy policy"),
+# so they are only dropped from the trailing footer block
+FOOTER_PATTERN = re.compile(
+    r'privacy policy|terms of (use|service)|sign up (here|now)|follow us on|all rights reserved|^\s*(©|copyright)',
+    re.IGNORECASE,
+)
+# Chrome lines are short; anything longer is a paragraph and is always kept
+BOILERPLATE_MAX_WORDS = 20
+# Footer links and legal notices are shorter still, unlike a sentence of news
+FOOTER_MAX_WORDS = 8
+
+_encoding = None
+
+
+def normalize_body(body):
+    """
+    Reduce an email body to its readable text.
+
+    Strips HTML residue and entities, bare links, and short chrome and footer
+    lines, and collapses whitespace while keeping paragraph breaks.
+
+    Args:
+        body (str): Raw email body
+
+    Returns:
+        str: Cleaned text
+    """
+    text = HIDDEN_BLOCK_PATTERN.sub(' ', body)
+    text = BLOCK_TAG_PATTERN.sub('\n', text)
+    text = html.unescape(TAG_PATTERN.sub(' ', text))
+    text = URL_PATTERN.sub('', text)
+
+    lines = [' '.join(line.split()) for line in text.splitlines()]
+    # The footer is the run of short lines the email ends with
+    footer_start = len(lines)
+    while footer_start and len(lines[footer_start - 1].split()) <= BOILERPLATE_MAX_WORDS:
+        footer_start -= 1
+
+    paragraphs = []
+    for i, line in enumerate(lines):
+        if not line:
+            if paragraphs and paragraphs[-1]:
+                paragraphs.append('')
+            continue
+        words = len(line.split())
+        if words <= BOILERPLATE_MAX_WORDS and CHROME_PATTERN.search(line):
+            continue
+        if i >= footer_start and words <= FOOTER_MAX_WORDS and FOOTER_PATTERN.search(line):
+            continue
+        paragraphs.append(line)
+    return '\n'.join(paragraphs).strip()
+
+
+def minhash_signature(text):
+    """
+    MinHash signature over word shingles, for estimating Jaccard similarity.
+
+    Args:
+        text (str): Normalized text
+
+    Returns:
+        list: MINHASH_PERMUTATIONS integers, or an empty list for very short text
+    """
+    words = WORD_PATTERN.findall(text.lower())
+    shingles = {
+        int.from_bytes(hashlib.blake2b(' '.join(words[i:i + SHINGLE_SIZE]).encode(), digest_size=8).digest(), 'big')
+        for i in range(max(len(words) - SHINGLE_SIZE + 1, 0))
+    }
+    if not shingles:
+        return []
+    return [min((a * shingle + b) % MINHASH_PRIME for shingle in shingles) for a, b in MINHASH_SEEDS]
+
+
+def similarity(signature, other):
+    """
+    Estimated Jaccard similarity of two MinHash signatures.
+    """
+    if not signature or not other:
+        return 0.0
+    return sum(x == y for x, y in zip(signature, other)) / len(signature)
+
+
+def compact_emails(emails, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """
+    Normalize emails and drop exact and near-duplicate stories.
+
+    The same wire story often arrives from several senders; only the first
+    copy is kept.
+
+    Args:
+        emails (list): Email dicts with "from" and "body" keys
+        threshold (float): Estimated Jaccard similarity above which two stories are duplicates
+
+    Returns:
+        list: Compacted email dicts with "from" and normalized "body"
+    """
+    kept = []
+    digests = set()
+    signatures = []
+    raw_size = 0
+
+    for email in emails:
+        raw_body = email.get('body', '')
+        raw_size += len(raw_body)
+        body = normalize_body(raw_body)
+        if not body:
+            continue
+
+        digest = hashlib.sha256(body.encode()).hexdigest()
+        if digest in digests:
+            continue
+
+        signature = minhash_signature(body)
+        if any(similarity(signature, other) >= threshold for other in signatures):
+            continue
+
+        digests.add(digest)
+        signatures.append(signature)
+        kept.append({"from": email.get('from', 'Unknown'), "body": body})
+
+    compact_size = sum(len(email['body']) for email in kept)
+    logger.info(f"[LOG] Compacted {len(emails)} emails ({raw_size} chars) to {len(kept)} stories ({compact_size} chars)")
+    return kept
+
+
+def story_fingerprint(text):
+    """
+    Short stable fingerprint of a story's text, insensitive to case and whitespace.
+
+    Args:
+        text (str): Story or excerpt text
+
+    Returns:
+        str: 16 hex characters
+    """
+    canonical = ' '.join(WORD_PATTERN.findall(text.lower()))
+    return hashlib.blake2b(canonical.encode(), digest_size=8).hexdigest()
+
+
+def count_tokens(text):
+    """
+    Count prompt tokens, exactly with tiktoken when installed, otherwise approximately.
+
+    Args:
+        text (str): Text to measure
+
+    Returns:
+        int: Token count
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # Roughly four characters per token for English prose
+    return len(text) // 4 + 1
+
+
+def _split_oversized(text, budget):
+    # Split on paragraphs, then hard-split any paragraph that is still too large
+    pieces = []
+    for paragraph in text.split('\n'):
+        if count_tokens(paragraph) <= budget:
+            pieces.append(paragraph + '\n')
+            continue
+        step = max(budget * 4, 1)
+        pieces.extend(paragraph[i:i + step] + '\n' for i in range(0, len(paragraph), step))
+    return pieces
+
+
+def chunk_text(text, budget=PROMPT_TOKEN_BUDGET, boundary=None):
+    """
+    Split text into chunks that each fit the token budget.
+
+    Args:
+        text (str): Text to split
+        budget (int): Maximum tokens per chunk
+        boundary (re.Pattern): Where chunks may start; defaults to paragraph breaks
+
+    Returns:
+        list: Chunks in order, a single chunk when the text already fits
+    """
+    if count_tokens(text) <= budget:
+        return [text]
+
+    units = [unit for unit in (boundary.split(text) if boundary else text.split('\n\n')) if unit]
+    if not boundary:
+        units = [unit + '\n\n' for unit in units]
+
+    chunks = []
+    current = ''
+    current_tokens = 0
+    for unit in units:
+        for piece in (_split_oversized(unit, budget) if count_tokens(unit) > budget else [unit]):
+            piece_tokens = count_tokens(piece)
+            if current and current_tokens + piece_tokens > budget:
+                chunks.append(current)
+                current, current_tokens = '', 0
+            current += piece
+            current_tokens += piece_tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def chunk_stories(stories, budget=PROMPT_TOKEN_BUDGET):
+    """
+    Split formatted stories into prompt-sized chunks, breaking between articles where possible.
+
+    Args:
+        stories (str): Output of format_stories()
+        budget (int): Maximum tokens per chunk
+
+    Returns:
+        list: Chunks in order
+    """
+    return chunk_text(stories, budget, STORY_BOUNDARY_PATTERN)
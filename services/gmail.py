@@ -1,6 +1,10 @@
+import atexit
 import os
+import queue
 import smtplib
+import ssl
 import logging
+import threading
 from email.message import EmailMessage
 
 # Set up logger
@@ -9,15 +13,170 @@ logger = logging.getLogger(__name__)
 # Environment variables
 GMAIL_USER = os.environ.get("GMAIL_USER")
 GMAIL_APP_PASSWORD = os.environ.get("GMAIL_APP_PASSWORD")
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "465"))
+SMTP_USE_SSL = os.environ.get("SMTP_USE_SSL", "true").lower() == "true"
+SMTP_POOL_SIZE = int(os.environ.get("SMTP_POOL_SIZE", "2"))
 
+# Errors where the server refused one message but the session is still usable
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+# Errors that mean the session is gone or never opened, so a fresh connection may succeed.
+# OSError covers dropped sockets, timeouts and TLS failures such as SSLEOFError.
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ssl.SSLError, OSError)
 
-def send_email_gmail(pdf_path, to_email):
+_sender = None
+_sender_lock = threading.Lock()
+
+
+def is_permanent_failure(error):
     """
-    Send an email with PDF attachment using Gmail SMTP.
-    
+    Whether a failed send would fail the same way if retried.
+
+    The server refusing the recipient, or answering with any other 5xx code,
+    is permanent; 4xx answers, dropped connections and timeouts are transient.
+
+    Args:
+        error (Exception): Error send_many() reported for a message
+
+    Returns:
+        bool: True if the message should not be retried
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        # Greylisting and full mailboxes refuse with 4xx and clear up on their own
+        return any(code >= 500 for code, _ in error.recipients.values()) or not error.recipients
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+
+class GmailSender:
+    """
+    Pool of authenticated SMTP sessions reused across messages.
+
+    Logging in once per connection instead of once per message avoids a TLS
+    handshake per recipient and keeps us under Gmail's login rate limits.
+    Dropped sessions are reconnected transparently on the next send.
+    """
+
+    def __init__(self, user=GMAIL_USER, password=GMAIL_APP_PASSWORD, host=SMTP_HOST,
+                 port=SMTP_PORT, use_ssl=SMTP_USE_SSL, pool_size=SMTP_POOL_SIZE):
+        self.user = user
+        self.password = password
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def _connect(self):
+        smtp = smtplib.SMTP_SSL(self.host, self.port) if self.use_ssl else smtplib.SMTP(self.host, self.port)
+        # Local stand-in servers run without credentials
+        if self.user and self.password:
+            smtp.login(self.user, self.password)
+        logger.info(f"[LOG] Opened SMTP session to {self.host}:{self.port}")
+        return smtp
+
+    def _close(self, smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            smtp.close()
+
+    def _deliver(self, smtp, msg):
+        # Returns (session to keep using or None, error or None); never raises
+        for attempt in range(2):
+            try:
+                if smtp is None:
+                    smtp = self._connect()
+                smtp.send_message(msg)
+                return smtp, None
+            except MESSAGE_ERRORS as e:
+                return smtp, e
+            except CONNECTION_ERRORS as e:
+                if smtp is not None:
+                    self._close(smtp)
+                smtp = None
+                if attempt:
+                    return None, e
+                logger.warning(f"[WARN] SMTP session dropped, reconnecting: {e}")
+            except Exception as e:
+                # The session is in an unknown state, so never hand it back to the pool
+                if smtp is not None:
+                    self._close(smtp)
+                return None, e
+
+    def send_many(self, messages):
+        """
+        Send several messages over one pooled session.
+
+        Args:
+            messages (list): EmailMessage objects to send
+
+        Returns:
+            list: (message, exception) for every message that could not be sent
+        """
+        failures = []
+        with self._slots:
+            try:
+                smtp = self._idle.get_nowait()
+            except queue.Empty:
+                smtp = None
+            try:
+                for msg in messages:
+                    smtp, error = self._deliver(smtp, msg)
+                    if error is None:
+                        logger.info(f"[LOG] Email sent successfully to {msg['To']}")
+                    else:
+                        logger.error(f"[ERROR] Failed to send email to {msg['To']}: {error}")
+                        failures.append((msg, error))
+            finally:
+                if smtp is not None:
+                    self._idle.put(smtp)
+        return failures
+
+    def send(self, msg):
+        """
+        Send a single message over a pooled session.
+
+        Args:
+            msg (EmailMessage): Message to send
+        """
+        failures = self.send_many([msg])
+        if failures:
+            raise failures[0][1]
+
+    def close(self):
+        """Close every idle session."""
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+def get_sender():
+    """
+    Return the process-wide sender, creating it on first use.
+
+    Returns:
+        GmailSender: Shared sender
+    """
+    global _sender
+    with _sender_lock:
+        if _sender is None:
+            _sender = GmailSender()
+            atexit.register(_sender.close)
+    return _sender
+
+
+def build_message(pdf, to_email):
+    """
+    Build the newsletter email with its PDF attachment.
+
     Args:
-        pdf_path (str): Path to the PDF file to attach
+        pdf (bytes or str): Rendered PDF bytes, or a path to the PDF file to attach
         to_email (str): Recipient email address
+
+    Returns:
+        EmailMessage: Message ready to send
     """
     msg = EmailMessage()
     msg['Subject'] = "Your Daily Newsletter"
@@ -25,11 +184,40 @@ def send_email_gmail(pdf_path, to_email):
     msg['To'] = to_email
     msg.set_content("Attached is your newsletter PDF.")
 
-    with open(pdf_path, 'rb') as f:
-        msg.add_attachment(f.read(), maintype='application', subtype='pdf', filename='newsletter.pdf')
+    if not isinstance(pdf, bytes):
+        with open(pdf, 'rb') as f:
+            pdf = f.read()
+    msg.add_attachment(pdf, maintype='application', subtype='pdf', filename='newsletter.pdf')
+    return msg
+
+
+def build_html_message(html, text, to_email):
+    """
+    Build the newsletter email with the newsletter inline as HTML, and a plain-text fallback.
+
+    Args:
+        html (str): Rendered HTML newsletter
+        text (str): Plain-text version for clients that do not show HTML
+        to_email (str): Recipient email address
+
+    Returns:
+        EmailMessage: Message ready to send
+    """
+    msg = EmailMessage()
+    msg['Subject'] = "Your Daily Newsletter"
+    msg['From'] = GMAIL_USER
+    msg['To'] = to_email
+    msg.set_content(text)
+    msg.add_alternative(html, subtype='html')
+    return msg
+
 
-    with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
-        smtp.login(GMAIL_USER, GMAIL_APP_PASSWORD)
-        smtp.send_message(msg)
-    
-    logger.info(f"[LOG] Email sent successfully to {to_email}")
+def send_email_gmail(pdf, to_email):
+    """
+    Send an email with PDF attachment using Gmail SMTP.
+
+    Args:
+        pdf (bytes or str): Rendered PDF bytes, or a path to the PDF file to attach
+        to_email (str): Recipient email address
+    """
+    get_sender().send(build_message(pdf, to_email))
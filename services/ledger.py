@@ -0,0 +1,289 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from services.storage import read_object, write_object
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Environment variables
+# "sqlite:///path/to/ledger.db", "gs://bucket/ledger" for a ledger shared between instances,
+# or "file:///path/to/ledger" for a local directory
+DELIVERY_LEDGER_URL = os.environ.get("DELIVERY_LEDGER_URL", "sqlite:////tmp/duw-ledger.sqlite3")
+# Set when a file:// ledger sits on storage every instance mounts, such as a shared volume
+DELIVERY_LEDGER_SHARED = os.environ.get("DELIVERY_LEDGER_SHARED", "false").lower() == "true"
+LEDGER_RETENTION_SECONDS = int(os.environ.get("LEDGER_RETENTION_SECONDS", str(3 * 24 * 3600)))
+# How long a delivered story is remembered per recipient
+SEEN_STORY_RETENTION_SECONDS = int(os.environ.get("SEEN_STORY_RETENTION_SECONDS", str(14 * 24 * 3600)))
+# How often a long-lived SQLite ledger deletes expired records as it is written to
+LEDGER_PRUNE_INTERVAL_SECONDS = int(os.environ.get("LEDGER_PRUNE_INTERVAL_SECONDS", "600"))
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def job_key(tickers, stories):
+    """
+    Key a newsletter's artifacts by everything that determines its content.
+
+    Args:
+        tickers (list): Tickers the newsletter covers
+        stories (str): Stories it is composed from
+
+    Returns:
+        str: Hex digest
+    """
+    stories_digest = hashlib.sha256(stories.encode()).hexdigest()
+    return hashlib.sha256(json.dumps([sorted(tickers), stories_digest]).encode()).hexdigest()
+
+
+class DeliveryLedger(ABC):
+    """
+    Run-scoped record of delivered recipients and of the artifacts generated
+    along the way, so a retried task skips finished recipients and resumes
+    from the last completed stage instead of regenerating everything.
+
+    Across runs, it also remembers the fingerprints of the stories each
+    recipient has been sent, so later newsletters only cover what is new.
+
+    Backends implement the methods below; artifacts are opaque bytes.
+    """
+
+    @abstractmethod
+    def is_delivered(self, run_id, email):
+        raise NotImplementedError
+
+    @abstractmethod
+    def mark_delivered(self, run_id, email):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_artifact(self, run_id, key, stage):
+        raise NotImplementedError
+
+    @abstractmethod
+    def put_artifact(self, run_id, key, stage, data):
+        raise NotImplementedError
+
+    @abstractmethod
+    def seen_stories(self, email):
+        """
+        Fingerprints of the stories already delivered to a recipient.
+
+        Returns:
+            set: Story fingerprints within SEEN_STORY_RETENTION_SECONDS
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def mark_seen(self, email, fingerprints):
+        raise NotImplementedError
+
+
+class SQLiteLedger(DeliveryLedger):
+    """Ledger in a local SQLite file, for single-instance deployments and tests."""
+
+    def __init__(self, path, retention_seconds=LEDGER_RETENTION_SECONDS, seen_retention_seconds=SEEN_STORY_RETENTION_SECONDS,
+                 prune_interval=LEDGER_PRUNE_INTERVAL_SECONDS):
+        self.path = path
+        self.retention_seconds = retention_seconds
+        self.seen_retention_seconds = seen_retention_seconds
+        self.prune_interval = prune_interval
+        self._pruned_at = 0.0
+        self._prune_lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS deliveries (
+                        run_id TEXT NOT NULL,
+                        email TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        PRIMARY KEY (run_id, email)
+                    )
+                """)
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS artifacts (
+                        run_id TEXT NOT NULL,
+                        job_key TEXT NOT NULL,
+                        stage TEXT NOT NULL,
+                        data BLOB NOT NULL,
+                        created_at REAL NOT NULL,
+                        PRIMARY KEY (run_id, job_key, stage)
+                    )
+                """)
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS seen_stories (
+                        email TEXT NOT NULL,
+                        fingerprint TEXT NOT NULL,
+                        seen_at REAL NOT NULL,
+                        PRIMARY KEY (email, fingerprint)
+                    )
+                """)
+        finally:
+            conn.close()
+        self._prune_if_due()
+
+    def _prune_if_due(self):
+        # Workers live for days and /tmp is memory on Cloud Run, so expired
+        # records are deleted on write rather than only at startup
+        now = time.time()
+        with self._prune_lock:
+            if now - self._pruned_at < self.prune_interval:
+                return
+            self._pruned_at = now
+        conn = self._connect()
+        try:
+            with conn:
+                cutoff = now - self.retention_seconds
+                conn.execute("DELETE FROM deliveries WHERE created_at < ?", (cutoff,))
+                conn.execute("DELETE FROM artifacts WHERE created_at < ?", (cutoff,))
+                conn.execute("DELETE FROM seen_stories WHERE seen_at < ?", (now - self.seen_retention_seconds,))
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # A connection per call keeps the ledger safe to use from any thread
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _query(self, sql, params):
+        conn = self._connect()
+        try:
+            with conn:
+                return conn.execute(sql, params).fetchone()
+        finally:
+            conn.close()
+
+    def is_delivered(self, run_id, email):
+        return self._query("SELECT 1 FROM deliveries WHERE run_id = ? AND email = ?", (run_id, email)) is not None
+
+    def mark_delivered(self, run_id, email):
+        self._query("INSERT OR IGNORE INTO deliveries VALUES (?, ?, ?)", (run_id, email, time.time()))
+        self._prune_if_due()
+
+    def get_artifact(self, run_id, key, stage):
+        row = self._query("SELECT data FROM artifacts WHERE run_id = ? AND job_key = ? AND stage = ?", (run_id, key, stage))
+        return bytes(row[0]) if row else None
+
+    def put_artifact(self, run_id, key, stage, data):
+        self._query("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?)", (run_id, key, stage, data, time.time()))
+        self._prune_if_due()
+
+    def seen_stories(self, email):
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT fingerprint FROM seen_stories WHERE email = ?", (email,)).fetchall()
+        finally:
+            conn.close()
+        return {row[0] for row in rows}
+
+    def mark_seen(self, email, fingerprints):
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO seen_stories VALUES (?, ?, ?)", [(email, fingerprint, now) for fingerprint in fingerprints])
+        finally:
+            conn.close()
+        self._prune_if_due()
+
+
+class ObjectStoreLedger(DeliveryLedger):
+    """
+    Ledger kept as small objects under a GCS or local directory prefix, so
+    every instance sees the same deliveries. Expire old runs with a bucket
+    lifecycle rule.
+    """
+
+    def __init__(self, base_url, seen_retention_seconds=SEEN_STORY_RETENTION_SECONDS):
+        self.base_url = base_url.rstrip('/')
+        self.seen_retention_seconds = seen_retention_seconds
+
+    def _url(self, *parts):
+        return '/'.join([self.base_url] + list(parts))
+
+    def _recipient(self, email):
+        # Hash addresses so they never appear in object names
+        return hashlib.sha256(email.lower().encode()).hexdigest()
+
+    def is_delivered(self, run_id, email):
+        return read_object(self._url(run_id, 'delivered', self._recipient(email))) is not None
+
+    def mark_delivered(self, run_id, email):
+        write_object(self._url(run_id, 'delivered', self._recipient(email)), b'1')
+
+    def get_artifact(self, run_id, key, stage):
+        return read_object(self._url(run_id, 'artifacts', key, stage))
+
+    def put_artifact(self, run_id, key, stage, data):
+        write_object(self._url(run_id, 'artifacts', key, stage), data)
+
+    def _read_seen(self, email):
+        # One object per recipient mapping fingerprint to when it was delivered
+        data = read_object(self._url('seen', self._recipient(email)))
+        seen = json.loads(data) if data else {}
+        cutoff = time.time() - self.seen_retention_seconds
+        return {fingerprint: seen_at for fingerprint, seen_at in seen.items() if seen_at >= cutoff}
+
+    def seen_stories(self, email):
+        return set(self._read_seen(email))
+
+    def mark_seen(self, email, fingerprints):
+        seen = self._read_seen(email)
+        now = time.time()
+        seen.update((fingerprint, now) for fingerprint in fingerprints)
+        write_object(self._url('seen', self._recipient(email)), json.dumps(seen).encode())
+
+
+def is_shared_ledger(url=DELIVERY_LEDGER_URL, shared=DELIVERY_LEDGER_SHARED):
+    """
+    Whether every instance sees the same ledger. SQLite files and local
+    directories live on one instance, so a retry that lands on another
+    instance finds them empty.
+
+    Returns:
+        bool: True for a GCS ledger, or when DELIVERY_LEDGER_SHARED says so
+    """
+    return url.startswith('gs://') or shared
+
+
+def open_ledger(url, retention_seconds=LEDGER_RETENTION_SECONDS, seen_retention_seconds=SEEN_STORY_RETENTION_SECONDS,
+                prune_interval=LEDGER_PRUNE_INTERVAL_SECONDS):
+    """
+    Build a ledger for a location in DELIVERY_LEDGER_URL form.
+
+    Args:
+        url (str): "sqlite:///path", "gs://bucket/prefix" or "file:///path"
+        retention_seconds (int): How long SQLite keeps deliveries and artifacts
+        seen_retention_seconds (int): How long a recipient's seen stories are kept
+        prune_interval (int): Minimum seconds between SQLite prunes
+
+    Returns:
+        DeliveryLedger: New ledger
+    """
+    if url.startswith('sqlite://'):
+        return SQLiteLedger(url[len('sqlite://'):], retention_seconds, seen_retention_seconds, prune_interval)
+    return ObjectStoreLedger(url, seen_retention_seconds)
+
+
+def get_ledger(url=DELIVERY_LEDGER_URL):
+    """
+    Return the process-wide ledger configured by DELIVERY_LEDGER_URL.
+
+    Returns:
+        DeliveryLedger: Shared ledger
+    """
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = open_ledger(url)
+            logger.info(f"[LOG] Using delivery ledger at {url}")
+    return _ledger
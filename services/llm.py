@@ -1,41 +1,520 @@
 import asyncio
+import hashlib
+import heapq
+import itertools
 import json
 import logging
 import os
-from openai import OpenAI
+import random
+import sqlite3
+import threading
+import time
+import weakref
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from collections import OrderedDict
+from services.corpus import chunk_stories, chunk_text, count_tokens
+from services.storage import read_object, write_object
+from utils import metrics
 
 # Set up logger
 logger = logging.getLogger(__name__)
 
 # Environment variables
 LLM_API_KEY = os.environ.get("HELICONE_API_KEY")
+LLM_MODEL = os.environ.get("LLM_MODEL", "gpt-5/openai")
+EXTRACTION_MODEL = os.environ.get("EXTRACTION_MODEL", LLM_MODEL)
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "16"))
+# Gateway rate limits to stay under; 0 disables the limit
+LLM_REQUESTS_PER_MINUTE = int(os.environ.get("LLM_REQUESTS_PER_MINUTE", "0"))
+LLM_TOKENS_PER_MINUTE = int(os.environ.get("LLM_TOKENS_PER_MINUTE", "0"))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF_BASE = float(os.environ.get("LLM_BACKOFF_BASE", "1"))
+LLM_BACKOFF_MAX = float(os.environ.get("LLM_BACKOFF_MAX", "60"))
+# Completion tokens assumed per request until the response reports actual usage
+LLM_COMPLETION_TOKENS_ESTIMATE = int(os.environ.get("LLM_COMPLETION_TOKENS_ESTIMATE", "1000"))
+# Completion cache: "memory", "sqlite:///path", a "gs://bucket/prefix" or "file:///path" shared store, or "off"
+LLM_CACHE_URL = os.environ.get("LLM_CACHE_URL", "sqlite:////tmp/duw-llm-cache.sqlite3")
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", str(2 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "10000"))
+
+# Bump when a prompt changes, so completions cached for the old prompt are not reused
+COMPOSE_PROMPT_VERSION = 1
+EXTRACTION_PROMPT_VERSION = 1
+
+# Queue priorities, lowest first: extraction blocks the whole run, composition one newsletter
+PRIORITY_EXTRACTION = 0
+PRIORITY_COMPOSE = 1
+
+# Errors a retry cannot fix
+NON_RETRYABLE_STATUSES = {400, 401, 403, 404, 422}
+
+# Client and request scheduler per event loop, since both are bound to the loop they run on
+_loop_state = weakref.WeakKeyDictionary()
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+_completion_cache = None
+_completion_cache_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Refills at a per-minute rate, holding at most one second's worth so
+    requests are paced evenly instead of bursting into the gateway's window.
+
+    Not locked itself; RateLimiter serializes access.
+    """
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60
+        self.capacity = max(self.rate, 1)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """
+        Seconds until amount can be taken, 0 if it can be now.
+
+        A request larger than the whole bucket is let through once the bucket
+        is full, leaving it in debt, so it is delayed rather than stuck forever.
+        """
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        if self.level >= needed:
+            return 0.0
+        return (needed - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= amount
+
+
+class RateLimiter:
+    """
+    Process-wide limits on requests and tokens per minute, shared by every
+    event loop, plus a pause that a 429 Retry-After imposes on all callers.
+    """
+
+    def __init__(self, requests_per_minute=LLM_REQUESTS_PER_MINUTE, tokens_per_minute=LLM_TOKENS_PER_MINUTE):
+        self._lock = threading.Lock()
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.paused_until = 0.0
+
+    def try_acquire(self, tokens):
+        """
+        Take one request and the estimated tokens if both limits allow it.
+
+        Args:
+            tokens (int): Estimated prompt plus completion tokens
+
+        Returns:
+            float: 0 if acquired, otherwise seconds to wait before trying again
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self.paused_until - now, 0.0)
+            if self.requests:
+                wait = max(wait, self.requests.wait_time(1, now))
+            if self.tokens:
+                wait = max(wait, self.tokens.wait_time(tokens, now))
+            if wait > 0:
+                return wait
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(tokens)
+            return 0.0
+
+    def settle(self, estimated, actual):
+        """
+        Correct the token bucket once a response reports its actual usage.
+        """
+        if self.tokens and actual:
+            with self._lock:
+                self.tokens.take(actual - estimated)
+
+    def pause(self, seconds):
+        """
+        Hold every caller back for a while, e.g. for a server's Retry-After.
+        """
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class LLMScheduler:
+    """
+    Admits requests in priority order, then first come first served, once the
+    shared rate limiter and the per-loop concurrency limit allow it.
+    """
+
+    def __init__(self, limiter, max_concurrency=LLM_MAX_CONCURRENCY):
+        self.limiter = limiter
+        self.max_concurrency = max_concurrency
+        self._queue = []
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._changed = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self, tokens, priority=PRIORITY_COMPOSE):
+        """
+        Wait for a turn to send one request.
+
+        Args:
+            tokens (int): Estimated tokens the request will use
+            priority (int): Lower runs first
+        """
+        entry = (priority, next(self._sequence))
+        start = time.monotonic()
+        async with self._changed:
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    wait = None
+                    if self._queue[0] == entry and self._in_flight < self.max_concurrency:
+                        wait = self.limiter.try_acquire(tokens)
+                        if not wait:
+                            break
+                    try:
+                        # Woken when a request finishes or the queue changes, or once the limiter has refilled
+                        await asyncio.wait_for(self._changed.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._changed.notify_all()
+            self._in_flight += 1
+        metrics.observe("llm_queue_seconds", time.monotonic() - start, labels={"priority": priority})
+        try:
+            yield
+        finally:
+            async with self._changed:
+                self._in_flight -= 1
+                self._changed.notify_all()
+
+
+def get_rate_limiter():
+    """
+    Return the process-wide rate limiter, creating it on first use.
+
+    Returns:
+        RateLimiter: Shared limiter
+    """
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter()
+    return _rate_limiter
+
+
+def cache_key(*parts):
+    """
+    Hash the inputs that determine a completion into a cache key.
+
+    Returns:
+        str: Hex SHA-256 of the JSON-encoded parts
+    """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+class CompletionCache(ABC):
+    """
+    Cache of parsed LLM completions, so a re-triggered run or retried task
+    does not pay again for a completion it already produced.
+
+    Entries expire after a TTL; backends implement _get and _put on JSON bytes.
+    """
+
+    def __init__(self, ttl=LLM_CACHE_TTL):
+        self.ttl = ttl
+
+    def get(self, key, kind):
+        """
+        Look up a completion.
+
+        Args:
+            key (str): Output of cache_key()
+            kind (str): What the completion is for, used to label the hit and miss counters
+
+        Returns:
+            dict: Cached completion, or None
+        """
+        try:
+            data = self._get(key)
+        except Exception as e:
+            logger.warning(f"[WARN] LLM cache read failed: {e}")
+            data = None
+        metrics.inc("llm_cache_requests_total", labels={"kind": kind, "result": "hit" if data is not None else "miss"})
+        return json.loads(data) if data is not None else None
+
+    def put(self, key, value):
+        try:
+            self._put(key, json.dumps(value).encode())
+        except Exception as e:
+            logger.warning(f"[WARN] LLM cache write failed: {e}")
+
+    @abstractmethod
+    def _get(self, key):
+        raise NotImplementedError
+
+    @abstractmethod
+    def _put(self, key, data):
+        raise NotImplementedError
+
+
+class MemoryCompletionCache(CompletionCache):
+    """In-process LRU cache, lost when the instance stops."""
+
+    def __init__(self, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return data
+
+    def _put(self, key, data):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteCompletionCache(CompletionCache):
+    """LRU cache in a local SQLite file, surviving restarts of the process."""
+
+    def __init__(self, path, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES):
+        super().__init__(ttl)
+        self.path = path
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS completions (
+                        key TEXT PRIMARY KEY,
+                        value BLOB NOT NULL,
+                        expires_at REAL NOT NULL,
+                        used_at REAL NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS completions_used_at ON completions (used_at)")
+                conn.execute("CREATE INDEX IF NOT EXISTS completions_expires_at ON completions (expires_at)")
+                conn.execute("DELETE FROM completions WHERE expires_at < ?", (time.time(),))
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _get(self, key):
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                row = conn.execute("SELECT value FROM completions WHERE key = ? AND expires_at >= ?", (key, now)).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE completions SET used_at = ? WHERE key = ?", (now, key))
+        finally:
+            conn.close()
+        return bytes(row[0]) if row else None
+
+    def _put(self, key, data):
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)", (key, data, now + self.ttl, now))
+                # Drop expired entries as we go, since a worker may run for days after it opened the cache
+                conn.execute("DELETE FROM completions WHERE expires_at < ?", (now,))
+                # Evict the least recently used entries beyond the size limit
+                conn.execute("""
+                    DELETE FROM completions WHERE key IN (
+                        SELECT key FROM completions ORDER BY used_at DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.max_entries,))
+        finally:
+            conn.close()
+
+
+class ObjectStoreCompletionCache(CompletionCache):
+    """
+    Cache shared by every instance, one object per completion under a GCS or
+    local prefix. Bound its size with a bucket lifecycle rule.
+    """
+
+    def __init__(self, base_url, ttl=LLM_CACHE_TTL):
+        super().__init__(ttl)
+        self.base_url = base_url.rstrip('/')
+
+    def _get(self, key):
+        data = read_object(f"{self.base_url}/{key}.json")
+        if not data:
+            return None
+        entry = json.loads(data)
+        if entry['expires_at'] < time.time():
+            return None
+        return entry['value'].encode()
+
+    def _put(self, key, data):
+        entry = {"expires_at": time.time() + self.ttl, "value": data.decode()}
+        write_object(f"{self.base_url}/{key}.json", json.dumps(entry).encode())
+
+
+def open_completion_cache(url, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES):
+    """
+    Build a completion cache for a location in LLM_CACHE_URL form.
+
+    Args:
+        url (str): "memory", "sqlite:///path", "gs://bucket/prefix" or "file:///path"
+        ttl (int): Seconds an entry stays valid
+        max_entries (int): Size bound of the memory and SQLite caches
+
+    Returns:
+        CompletionCache: New cache
+    """
+    if url == "memory":
+        return MemoryCompletionCache(ttl, max_entries)
+    if url.startswith('sqlite://'):
+        return SQLiteCompletionCache(url[len('sqlite://'):], ttl, max_entries)
+    return ObjectStoreCompletionCache(url, ttl)
+
+
+def get_completion_cache(url=LLM_CACHE_URL):
+    """
+    Return the process-wide completion cache configured by LLM_CACHE_URL.
+
+    Returns:
+        CompletionCache: Shared cache, or None when caching is off
+    """
+    global _completion_cache
+    if not url or url == "off":
+        return None
+    with _completion_cache_lock:
+        if _completion_cache is None:
+            _completion_cache = open_completion_cache(url)
+            logger.info(f"[LOG] Using LLM completion cache at {url}")
+    return _completion_cache
 
 
 def create_openai_client():
     """
-    Create and return an OpenAI client configured for Helicone.
+    Create and return an async OpenAI client configured for Helicone.
+    
+    The client keeps a pool of keep-alive connections sized to LLM_MAX_CONCURRENCY.
+    openai is imported here rather than at module load, since it is the slowest
+    import in the app and adds directly to cold start.
     
     Returns:
-        OpenAI: Configured OpenAI client
+        AsyncOpenAI: Configured OpenAI client
     """
-    return OpenAI(
+    import httpx
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+    return AsyncOpenAI(
         api_key=LLM_API_KEY,
-        base_url="https://ai-gateway.helicone.ai/v1"
+        base_url="https://ai-gateway.helicone.ai/v1",
+        max_retries=0,  # Retries go through the shared scheduler instead
+
+        http_client=DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONCURRENCY,
+                max_keepalive_connections=LLM_MAX_CONCURRENCY,
+            ),
+        ),
     )
 
 
-async def call_llm(ticker, stories, client):
+def _get_loop_state():
+    loop = asyncio.get_running_loop()
+    if loop not in _loop_state:
+        _loop_state[loop] = (create_openai_client(), LLMScheduler(get_rate_limiter()))
+    return _loop_state[loop]
+
+
+def get_openai_client():
+    """
+    Return the shared client for the running event loop, creating it on first use.
+    
+    Returns:
+        AsyncOpenAI: Shared OpenAI client
+    """
+    return _get_loop_state()[0]
+
+
+async def call_llm(ticker, stories, client=None):
     """
     Call the LLM to analyze newsletter content for stock-related stories.
     
+    Stories larger than PROMPT_TOKEN_BUDGET are split between articles and
+    composed chunk by chunk, then merged into one newsletter. Complete results
+    are cached by model, ticker set and stories, so the same newsletter is
+    never paid for twice.
+    
     Args:
         ticker (str): Stock ticker symbol to check against
-        email (str): Newsletter content to analyze
-        client (OpenAI): OpenAI client instance
+        stories (str): Newsletter content to analyze
+        client (AsyncOpenAI): Optional client, defaults to the shared one
         
     Returns:
-        list: List of related stories or empty list if none found
+        dict: Newsletter with "title" and markdown "body", empty body if nothing is related.
+            When a chunk's completion failed, the body is partial or empty and the
+            letter carries "incomplete": True, so callers can tell it from a real answer.
     """
+    cache = get_completion_cache()
+    key = cache_key("compose", LLM_MODEL, COMPOSE_PROMPT_VERSION, sorted(ticker), hashlib.sha256(stories.encode()).hexdigest())
+    cached = await asyncio.to_thread(cache.get, key, "compose") if cache else None
+    if cached is not None:
+        logger.info(f"[LOG] Using cached newsletter for {len(ticker)} tickers")
+        return cached
+    
+    chunks = chunk_stories(stories)
+    if len(chunks) > 1:
+        logger.info(f"[LOG] Stories exceed the prompt budget, composing in {len(chunks)} chunks")
+    with metrics.span("call_llm", chunks=len(chunks)):
+        letters = await asyncio.gather(*(_compose_newsletter(ticker, chunk, client) for chunk in chunks))
+    letters = [letter for letter in letters if letter is not None]
+    if not letters:
+        return {
+            "title": "title of the newsletter",
+            "body": "",
+            "incomplete": True,
+        }
+    
+    # Title the newsletter after the first chunk that found something
+    found = [letter for letter in letters if letter.get("body")]
+    letter = {
+        "title": (found or letters)[0].get("title", ""),
+        "body": "\n\n".join(letter["body"] for letter in found),
+    }
+    # A chunk that failed would be missing from the letter, so only complete letters are cached
+    if len(letters) < len(chunks):
+        letter["incomplete"] = True
+    elif cache:
+        await asyncio.to_thread(cache.put, key, letter)
+    return letter
+
+
+async def _compose_newsletter(ticker, stories, client):
     prompt = f"""
 You are a financial analyst. Your job is to carefully review the following newsletters, and create a single newsletter ony containing information related to the attached stocks.
 
@@ -99,25 +578,182 @@ Here is the newsletter content:
 {stories}
 
     """
-    max_retries = 5
-    for i in range(max_retries):
+    return await _complete_json(prompt, client, LLM_MODEL, f"ticker {ticker}")
+
+
+async def extract_story_facts(author, story, tickers, client=None):
+    """
+    Map step: pull the passages of a single story that concern each ticker.
+    
+    Run once per story per orchestrator run, so per-user newsletters can be
+    composed from short excerpts instead of re-reading the full corpus.
+    
+    Args:
+        author (str): Sender of the story, kept for attribution
+        story (str): Full text of the story
+        tickers (list): Tickers the story might mention
+        client (AsyncOpenAI): Optional client, defaults to the shared one
+        
+    Returns:
+        dict: Ticker mapped to a list of verbatim excerpts, or None if extraction failed
+    """
+    cache = get_completion_cache()
+    key = cache_key("extract", EXTRACTION_MODEL, EXTRACTION_PROMPT_VERSION, sorted(tickers), author, hashlib.sha256(story.encode()).hexdigest())
+    cached = await asyncio.to_thread(cache.get, key, "extract") if cache else None
+    if cached is not None:
+        return cached
+    
+    chunks = chunk_text(story)
+    results = await asyncio.gather(*(_extract_facts(author, chunk, tickers, client) for chunk in chunks))
+    if any(facts is None for facts in results):
+        return None
+    
+    merged = {}
+    for facts in results:
+        for ticker, excerpts in facts.items():
+            merged.setdefault(ticker, []).extend(excerpts)
+    if cache:
+        await asyncio.to_thread(cache.put, key, merged)
+    return merged
+
+
+async def _extract_facts(author, story, tickers, client):
+    prompt = f"""
+You are a financial analyst. Read the story below, written by {author}, and pull out every passage that contains information about any of these stocks:
+{tickers}
+
+Copy the passages word for word. Do not summarize, rephrase, or add anything that is not in the story.
+If a passage is about several of the stocks, list it under each of them.
+If the story has no information about a stock, leave that stock out.
+
+CRITICAL FORMATING INFORMATION:
+You must return the passages in the following json format:
+```json
+{{
+    "TICKER": ["passage", "passage"]
+}}
+```
+
+If the story is not about any of the stocks, YOU MUST GIVE BACK AN EMPTY OBJECT
+```json
+{{}}
+```
+
+Here is the story:
+
+{story}
+
+    """
+    facts = await _complete_json(prompt, client, EXTRACTION_MODEL, f"story by {author}", PRIORITY_EXTRACTION)
+    if facts is None:
+        return None
+    return {
+        ticker: [excerpt for excerpt in excerpts if isinstance(excerpt, str) and excerpt.strip()]
+        for ticker, excerpts in facts.items()
+        if ticker in tickers and isinstance(excerpts, list)
+    }
+
+
+async def _complete_json(prompt, client, model, label, priority=PRIORITY_COMPOSE):
+    """
+    Run a completion and parse the JSON object it returns, retrying on failure.
+    
+    Requests wait their turn in the loop's scheduler, which keeps the process
+    under the gateway's rate limits. Failures back off exponentially with
+    jitter, and a 429 pauses every caller for as long as the server asks.
+    
+    Args:
+        prompt (str): Prompt to send
+        client (AsyncOpenAI): Client to use, or None for the shared one
+        model (str): Model to use
+        label (str): What the call is for, used in error logs
+        priority (int): Queue priority, lower runs first
+        
+    Returns:
+        dict: Parsed JSON object, or None if every attempt failed
+    """
+    shared_client, scheduler = _get_loop_state()
+    client = client or shared_client
+    estimate = count_tokens(prompt) + LLM_COMPLETION_TOKENS_ESTIMATE
+    for attempt in range(LLM_MAX_RETRIES):
+        if attempt:
+            metrics.inc("llm_retries_total", labels={"model": model})
+        retry_after = None
         try:
-            response = client.chat.completions.create(
-                model="gpt-5/openai",
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-            )
+            async with scheduler.slot(estimate, priority):
+                with metrics.span("llm_request", model=model, label=label):
+                    response = await client.chat.completions.create(
+                        model=model,
+                        messages=[
+                            {"role": "user", "content": prompt}
+                        ],
+                    )
             logger.info(response)
+            _record_usage(model, response)
+            scheduler.limiter.settle(estimate, getattr(getattr(response, 'usage', None), 'total_tokens', 0))
             text = response.choices[0].message.content
             cleaned_text = text.replace('```json', '').replace('```', '').replace('```json\n', '').replace('\n```','').strip()
             if cleaned_text.startswith('{') and cleaned_text.endswith('}'):
-                return json.loads(cleaned_text)
-            await asyncio.sleep(i*2)
+                parsed = json.loads(cleaned_text)
+                metrics.inc("llm_requests_total", labels={"model": model, "outcome": "ok"})
+                return parsed
+            metrics.inc("llm_requests_total", labels={"model": model, "outcome": "invalid_json"})
         except Exception as e:
-            logger.error(f"[ERROR] LLM call failed for ticker {ticker}: {e}")
-            await asyncio.sleep(i*2)
-    return {
-        "title": "title of the newsletter",
-        "body": ""
-    }
+            logger.error(f"[ERROR] LLM call failed for {label}: {e}")
+            status = getattr(e, 'status_code', None)
+            if status in NON_RETRYABLE_STATUSES:
+                metrics.inc("llm_requests_total", labels={"model": model, "outcome": "error"})
+                return None
+            retry_after = _retry_after(e)
+            if status == 429 or retry_after is not None:
+                metrics.inc("llm_requests_total", labels={"model": model, "outcome": "rate_limited"})
+                # Hold back every caller, not just this one, so they do not all retry into the limit
+                scheduler.limiter.pause(retry_after if retry_after is not None else _backoff(attempt))
+            else:
+                metrics.inc("llm_requests_total", labels={"model": model, "outcome": "error"})
+        if attempt == LLM_MAX_RETRIES - 1:
+            break
+        delay = _backoff(attempt, retry_after)
+        metrics.inc("llm_backoff_seconds_total", delay, labels={"model": model})
+        await asyncio.sleep(delay)
+    return None
+
+
+def _backoff(attempt, retry_after=None):
+    """
+    Delay before the next attempt: the server's hint when it gave one,
+    otherwise exponential with jitter so callers that failed together spread out.
+    """
+    if retry_after is not None:
+        return retry_after + random.uniform(0, LLM_BACKOFF_BASE)
+    ceiling = min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt)
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+def _retry_after(error):
+    """
+    Seconds the server asked us to wait, from the Retry-After headers of a failed response.
+    """
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms') is not None:
+            return float(headers['retry-after-ms']) / 1000
+        value = headers.get('retry-after')
+        if value is None:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _record_usage(model, response):
+    usage = getattr(response, 'usage', None)
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        metrics.inc("llm_tokens_total", getattr(usage, kind, 0) or 0, labels={"model": model, "kind": kind})
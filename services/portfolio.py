@@ -1,84 +1,302 @@
+import logging
 import os
-import psycopg
-from dotenv import load_dotenv
+import threading
 
-load_dotenv()
+# A .env file is only used in local development, so skip importing dotenv when there is none
+if os.path.exists(".env") or os.path.exists(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".env")):
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+# Set up logger
+logger = logging.getLogger(__name__)
 
 URL = os.environ.get("NEON_PASS")
+POOL_SIZE = int(os.environ.get("PORTFOLIO_POOL_SIZE", "2"))
 
-def fetch_portfolios():
+# Users with their emails and portfolios with stocks, ordered so each user's rows are contiguous
+PORTFOLIO_QUERY = """
+SELECT 
+    us.email,
+    p.name as portfolio_name,
+    ARRAY_AGG(s.ticker) as tickers
+FROM profiles pr
+JOIN neon_auth.users_sync us ON pr.id = us.id
+LEFT JOIN portfolios p ON pr.id = p.user_id
+LEFT JOIN stocks s ON p.id = s.portfolio_id
+WHERE us.email IS NOT NULL
+GROUP BY us.email, p.name, p.id
+ORDER BY us.email, p.name;
+"""
+
+# Change marker for the tables behind PORTFOLIO_QUERY: a version row bumped by
+# statement triggers on each of them (see sql/portfolio_version.sql)
+WATERMARK_QUERY = os.environ.get("PORTFOLIO_WATERMARK_QUERY", "SELECT version::text FROM portfolio_version;")
+
+# Legal names of held tickers, used to match stories that name the company instead of the symbol
+COMPANY_NAMES_QUERY = os.environ.get("COMPANY_NAMES_QUERY", """
+SELECT ticker, MAX(name)
+FROM stocks
+WHERE name IS NOT NULL
+GROUP BY ticker;
+""")
+
+_pool = None
+
+
+def collect_tickers(portfolio_data):
     """
-    Fetch the list of portfolios/stock symbols to monitor from NeonDB.
+    Flatten every account in a portfolio into a single list of unique tickers.
     
+    Args:
+        portfolio_data (dict): Portfolio object mapping account names to ticker lists
+        
     Returns:
-        list: List of user dictionaries with their portfolios and tickers
+        list: Unique tickers in the order they first appear
+    """
+    unique_tickers = []
+    seen = set()
+    for tickers in portfolio_data.values():
+        for ticker in tickers:
+            if ticker not in seen:
+                unique_tickers.append(ticker)
+                seen.add(ticker)
+    return unique_tickers
+
+
+def group_portfolios(portfolios):
+    """
+    Group recipients whose portfolios hold exactly the same set of tickers.
+    
+    Each distinct ticker set only needs one newsletter, so callers can generate
+    it once and deliver it to every email in the group.
+    
+    Args:
+        portfolios (iterable): Output of fetch_portfolios() or iter_portfolios()
+        
+    Returns:
+        list: One dict per distinct ticker set
         Format: [
-            {email: {portfolio1: [ticker1, ticker2], portfolio2: [ticker1, ticker2]}},
-            {email: {portfolio1: [ticker1, ticker2]}}
+            {"tickers": [ticker1, ticker2], "emails": [email1, email2]},
         ]
     """
+    groups = {}
+    for user_portfolio in portfolios:
+        for email, portfolio in user_portfolio.items():
+            key = tuple(sorted(collect_tickers(portfolio)))
+            if key not in groups:
+                groups[key] = {"tickers": list(key), "emails": []}
+            groups[key]["emails"].append(email)
+    return list(groups.values())
+
+
+class SubscriberIndex:
+    """
+    Inverted index from ticker to the emails of users holding it.
+
+    sync() compares each user's tickers with what the index already holds and
+    only touches the entries of users who were added, removed, or changed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_ticker = {}
+        self._by_email = {}
+
+    def _remove(self, email):
+        for ticker in self._by_email.pop(email, ()):
+            subscribers = self._by_ticker.get(ticker)
+            if subscribers is not None:
+                subscribers.discard(email)
+                if not subscribers:
+                    del self._by_ticker[ticker]
+
+    def _add(self, email, tickers):
+        self._by_email[email] = tickers
+        for ticker in tickers:
+            self._by_ticker.setdefault(ticker, set()).add(email)
+
+    def sync(self, portfolios):
+        """
+        Bring the index in line with the current portfolios.
+
+        Args:
+            portfolios (iterable): Output of fetch_portfolios() or load_portfolios()
+
+        Returns:
+            int: Number of users added, changed or removed
+        """
+        current = {}
+        for user_portfolio in portfolios:
+            for email, portfolio in user_portfolio.items():
+                current[email] = frozenset(collect_tickers(portfolio))
+
+        changed = 0
+        with self._lock:
+            for email in [email for email in self._by_email if email not in current]:
+                self._remove(email)
+                changed += 1
+            for email, tickers in current.items():
+                if self._by_email.get(email) != tickers:
+                    self._remove(email)
+                    self._add(email, tickers)
+                    changed += 1
+        return changed
+
+    def tickers(self):
+        """
+        Every ticker held by at least one user.
+
+        Returns:
+            list: Sorted tickers
+        """
+        with self._lock:
+            return sorted(self._by_ticker)
+
+    def emails(self):
+        """
+        Every user holding at least one ticker; users with no portfolios,
+        or only empty ones, are never sent anything.
+
+        Returns:
+            set: Emails
+        """
+        with self._lock:
+            return {email for email, tickers in self._by_email.items() if tickers}
+
+    def subscribers(self, tickers):
+        """
+        Users holding any of the given tickers.
+
+        Args:
+            tickers (iterable): Ticker symbols
+
+        Returns:
+            set: Emails
+        """
+        with self._lock:
+            return set().union(*(self._by_ticker.get(ticker, ()) for ticker in tickers))
+
+
+def get_pool():
+    """
+    Return the process-wide NeonDB connection pool, opening it on first use.
+    
+    Keeping connections open across runs saves a TLS handshake and, on a
+    suspended serverless database, most of its cold-start latency.
+    
+    Returns:
+        ConnectionPool: Shared connection pool
+    """
+    global _pool
+    if _pool is None:
+        from psycopg_pool import ConnectionPool
+
+        _pool = ConnectionPool(
+            URL,
+            min_size=1,
+            max_size=POOL_SIZE,
+            check=ConnectionPool.check_connection,  # Neon drops idle connections, so test before use
+            open=True,
+        )
+    return _pool
+
+
+def iter_portfolios(batch_size=500, raise_errors=False):
+    """
+    Stream portfolios from NeonDB, one user at a time.
+    
+    Rows come through a server-side cursor in batches of batch_size, and since
+    the query is ordered by email each user is yielded as soon as their last
+    row arrives, so memory stays flat however many users there are.
+    
+    Args:
+        batch_size (int): Rows fetched from the server per round trip
+        raise_errors (bool): Raise on failure instead of logging and ending the stream early
+        
+    Yields:
+        dict: {email: {portfolio1: [ticker1, ticker2], portfolio2: [ticker1]}}
+    """
     try:
-        db_url = URL
-        if not db_url:
-            print("Error: NEON_PASS environment variable not set.")
-            print("Please set it to your Neon database connection string.")
-            return []
+        if not URL:
+            logger.error("[ERROR] NEON_PASS environment variable not set; set it to your Neon database connection string")
+            return
         
-        # Connect to NeonDB using the connection string
-        with psycopg.connect(db_url) as conn:
-            cursor = conn.cursor()
-            
-            # Query to get users with their emails and portfolios with stocks
-            query = """
-            SELECT 
-                us.email,
-                p.name as portfolio_name,
-                ARRAY_AGG(s.ticker) as tickers
-            FROM profiles pr
-            JOIN neon_auth.users_sync us ON pr.id = us.id
-            LEFT JOIN portfolios p ON pr.id = p.user_id
-            LEFT JOIN stocks s ON p.id = s.portfolio_id
-            WHERE us.email IS NOT NULL
-            GROUP BY us.email, p.name, p.id
-            ORDER BY us.email, p.name;
-            """
-            
-            cursor.execute(query)
-            results = cursor.fetchall()
-            
-            # Get column names from cursor description
-            columns = [desc[0] for desc in cursor.description]
-            
-            # Organize data by user email
-            user_portfolios = {}
-            
-            for row in results:
-                # Convert tuple to dict using column names
-                row_dict = dict(zip(columns, row))
-                email = row_dict['email']
-                portfolio_name = row_dict['portfolio_name']
-                tickers = row_dict['tickers'] or []  # Handle NULL case
-                
-                # Remove None values from tickers list
-                tickers = [ticker for ticker in tickers if ticker is not None]
+        with get_pool().connection() as conn:
+            with conn.cursor(name="portfolio_stream") as cursor:
+                cursor.itersize = batch_size
+                cursor.execute(PORTFOLIO_QUERY)
                 
-                if email not in user_portfolios:
-                    user_portfolios[email] = {}
+                current_email = None
+                current_portfolios = {}
+                for email, portfolio_name, tickers in cursor:
+                    if email != current_email:
+                        if current_email is not None:
+                            yield {current_email: current_portfolios}
+                        current_email = email
+                        current_portfolios = {}
+                    
+                    if portfolio_name:
+                        # Handle NULL arrays and remove None values from tickers list
+                        current_portfolios[portfolio_name] = [ticker for ticker in tickers or [] if ticker is not None]
                 
-                if portfolio_name:
-                    user_portfolios[email][portfolio_name] = tickers
-            
-            # Convert to the requested format
-            result = []
-            for email, portfolios in user_portfolios.items():
-                result.append({email: portfolios})
-            
-            return result
+                if current_email is not None:
+                    yield {current_email: current_portfolios}
         
     except Exception as e:
-        print(f"Error fetching portfolios from NeonDB: {e}")
-        # Return empty list on error
-        return []
+        if raise_errors:
+            raise
+        logger.error(f"[ERROR] Failed to fetch portfolios from NeonDB: {e}")
+
+
+def fetch_watermark():
+    """
+    Fetch a marker that changes whenever the portfolio tables change.
+    
+    Returns:
+        list: Marker values to compare against a cached snapshot's, or None on error
+    """
+    try:
+        if not URL:
+            return None
+        with get_pool().connection() as conn:
+            row = conn.execute(WATERMARK_QUERY).fetchone()
+            return [str(value) for value in row]
+    except Exception as e:
+        logger.error(f"[ERROR] Failed to fetch portfolio watermark from NeonDB: {e}")
+        return None
+
+
+def fetch_company_names():
+    """
+    Fetch the company name of every held ticker.
+    
+    Returns:
+        dict: Upper-cased ticker mapped to its company name, empty on error
+    """
+    try:
+        if not URL or not COMPANY_NAMES_QUERY.strip():
+            return {}
+        with get_pool().connection() as conn:
+            rows = conn.execute(COMPANY_NAMES_QUERY).fetchall()
+            return {ticker.upper(): name for ticker, name in rows if ticker and name}
+    except Exception as e:
+        logger.error(f"[ERROR] Failed to fetch company names from NeonDB: {e}")
+        return {}
+
+
+def fetch_portfolios():
+    """
+    Fetch the list of portfolios/stock symbols to monitor from NeonDB.
+    
+    Returns:
+        list: List of user dictionaries with their portfolios and tickers
+        Format: [
+            {email: {portfolio1: [ticker1, ticker2], portfolio2: [ticker1, ticker2]}},
+            {email: {portfolio1: [ticker1, ticker2]}}
+        ]
+    """
+    return list(iter_portfolios())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,262 @@
+import json
+import logging
+import os
+import re
+
+from services.corpus import story_fingerprint
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Environment variables
+TICKER_ALIASES_PATH = os.environ.get("TICKER_ALIASES_PATH")
+
+# Short names and nicknames readers see in newsletters for commonly held tickers, on top
+# of the company names loaded from the database. Extend with a JSON file of
+# {ticker: [alias, ...]} via TICKER_ALIASES_PATH.
+TICKER_ALIASES = {
+    "AAPL": ["Apple"],
+    "AMD": ["Advanced Micro Devices"],
+    "AMZN": ["Amazon"],
+    "AVGO": ["Broadcom"],
+    "BAC": ["Bank of America"],
+    "BMO": ["Bank of Montreal"],
+    "BNS": ["Bank of Nova Scotia", "Scotiabank"],
+    "BRK.B": ["Berkshire Hathaway", "Berkshire"],
+    "BTC": ["Bitcoin"],
+    "CM": ["Canadian Imperial Bank of Commerce", "CIBC"],
+    "COST": ["Costco"],
+    "ETH": ["Ethereum", "Ether"],
+    "GOOG": ["Google", "Alphabet"],
+    "GOOGL": ["Google", "Alphabet"],
+    "INTC": ["Intel"],
+    "JPM": ["JPMorgan", "JP Morgan"],
+    "META": ["Meta", "Facebook", "Instagram"],
+    "MSFT": ["Microsoft"],
+    "NA": ["National Bank of Canada"],
+    "NFLX": ["Netflix"],
+    "NVDA": ["Nvidia"],
+    "ORCL": ["Oracle"],
+    "RY": ["Royal Bank of Canada", "RBC"],
+    "SHOP": ["Shopify"],
+    "TD": ["Toronto-Dominion", "TD Bank"],
+    "TSLA": ["Tesla"],
+    "TSM": ["TSMC", "Taiwan Semiconductor"],
+    "VOO": ["S&P 500"],
+    "VOOG": ["S&P 500"],
+    "WMT": ["Walmart"],
+}
+
+# Upper-case symbols, optionally cashtagged and with a share class/exchange suffix (BRK.B, RY.TO)
+SYMBOL_PATTERN = re.compile(r"(?<![\w$])(\$?)([A-Z]{1,5}(?:[.\-][A-Z]{1,2})?)(?![\w])")
+WORD_PATTERN = re.compile(r"[a-z0-9&]+(?:['\-][a-z0-9]+)*")
+# Legal-form and share-class words stories leave out of a company's name ("Nvidia", not "NVIDIA Corporation")
+LEGAL_SUFFIX_PATTERN = re.compile(
+    r"(?:[\s,]+(?:inc|incorporated|corp|corporation|co|company|ltd|limited|plc|llc|lp|ag|sa|nv|se|"
+    r"holdings?|group|class [a-c]|common stock|ordinary shares|ads|adr)\.?)+$",
+    re.IGNORECASE,
+)
+
+
+def company_aliases(names):
+    """
+    Turn company names into aliases the way stories write them.
+
+    Args:
+        names (dict): Ticker mapped to a company name, e.g. {"NVDA": "NVIDIA Corporation"}
+
+    Returns:
+        dict: Upper-cased ticker mapped to the name with and without its legal suffix
+    """
+    aliases = {}
+    for ticker, name in names.items():
+        name = name.strip()
+        short = LEGAL_SUFFIX_PATTERN.sub('', re.sub(r"^the\s+", '', name, flags=re.IGNORECASE)).strip(' ,.')
+        aliases[ticker.upper()] = [alias for alias in dict.fromkeys([name, short]) if alias]
+    return aliases
+
+
+def load_aliases(company_names=None, path=TICKER_ALIASES_PATH):
+    """
+    Build the ticker -> company alias map used to match stories.
+
+    Args:
+        company_names (dict): Optional ticker -> company name from the database
+        path (str): Optional JSON file with extra {ticker: [alias, ...]} entries
+
+    Returns:
+        dict: Upper-cased ticker mapped to a list of aliases
+    """
+    aliases = {ticker: list(names) for ticker, names in TICKER_ALIASES.items()}
+    for ticker, names in company_aliases(company_names or {}).items():
+        known = aliases.setdefault(ticker, [])
+        known.extend(name for name in names if name not in known)
+    if path:
+        try:
+            with open(path) as f:
+                for ticker, names in json.load(f).items():
+                    aliases.setdefault(ticker.upper(), []).extend(names)
+        except Exception as e:
+            logger.error(f"[ERROR] Failed to load ticker aliases from {path}: {e}")
+    return aliases
+
+
+def format_stories(stories):
+    """
+    Render stories into the text block the LLM prompt expects.
+
+    Args:
+        stories (list): Story dicts with "author" and "body" keys
+
+    Returns:
+        str: Stories formatted as "Article by: <author>\\n Story: <body>"
+    """
+    return ''.join(
+        f"Article by: {story['author']}\n Story: {story['body']}\n\n" for story in stories
+    )
+
+
+class StoryIndex:
+    """
+    Lexical index over the day's emails, used to hand each worker only the
+    stories that could mention its tickers.
+
+    Matching is deliberately permissive: a false positive costs a few prompt
+    tokens, a false negative drops a story the reader should have seen.
+    """
+
+    def __init__(self, emails, aliases=None):
+        self.aliases = aliases if aliases is not None else load_aliases()
+        self.stories = []
+        self._symbols = {}
+        self._words = {}
+        self._texts = []
+
+        for position, email in enumerate(emails):
+            body = email.get('body', '')
+            self.stories.append({"author": email.get('from', 'Unknown'), "body": body})
+
+            for cashtag, symbol in SYMBOL_PATTERN.findall(body):
+                self._symbols.setdefault(symbol, set()).add(position)
+                if cashtag:
+                    self._symbols.setdefault('$' + symbol, set()).add(position)
+
+            text = ' '.join(WORD_PATTERN.findall(body.lower()))
+            self._texts.append(text)
+            for word in set(text.split()):
+                self._words.setdefault(word, set()).add(position)
+
+    def to_corpus(self, excerpts=None):
+        """
+        Serialize the stories, aliases and map-phase excerpts so a worker can
+        rebuild the index and match stories the way the orchestrator did.
+
+        Args:
+            excerpts (dict): Optional story position -> {ticker: [excerpt]}
+
+        Returns:
+            dict: JSON-safe corpus accepted by from_corpus()
+        """
+        return {
+            "emails": [{"from": story['author'], "body": story['body']} for story in self.stories],
+            "aliases": self.aliases,
+            "excerpts": None if excerpts is None else {str(position): facts for position, facts in excerpts.items()},
+        }
+
+    @classmethod
+    def from_corpus(cls, corpus, aliases=None):
+        """
+        Rebuild an index and its excerpts from to_corpus() output.
+
+        Args:
+            corpus (dict): Output of to_corpus()
+            aliases (dict): Optional ticker -> aliases map, instead of the corpus's own
+
+        Returns:
+            tuple: (StoryIndex, excerpts or None)
+        """
+        excerpts = corpus.get('excerpts')
+        if excerpts is not None:
+            excerpts = {int(position): facts for position, facts in excerpts.items()}
+        return cls(corpus['emails'], aliases if aliases is not None else corpus.get('aliases')), excerpts
+
+    def _match_alias(self, alias):
+        words = WORD_PATTERN.findall(alias.lower())
+        if not words:
+            return set()
+        if len(words) == 1:
+            return self._words.get(words[0], set())
+
+        # Narrow to stories containing every word before checking the phrase itself
+        phrase = ' '.join(words)
+        candidates = set.intersection(*(self._words.get(word, set()) for word in words))
+        return {position for position in candidates if phrase in self._texts[position]}
+
+    def match(self, tickers):
+        """
+        Find the stories that could be about any of the given tickers.
+
+        Args:
+            tickers (list): Ticker symbols to look for
+
+        Returns:
+            list: Positions of matching stories, in their original order
+        """
+        matches = set()
+        for ticker in tickers:
+            symbol = ticker.upper()
+            base = re.split(r"[.\-]", symbol)[0]
+            for candidate in {symbol, base}:
+                # Single letters are ordinary words ("A", "I"), so only trust cashtags for them
+                key = candidate if len(candidate) > 1 else '$' + candidate
+                matches |= self._symbols.get(key, set())
+            for alias in self.aliases.get(symbol, []) + self.aliases.get(base, []):
+                matches |= self._match_alias(alias)
+        return sorted(matches)
+
+    def tickers_by_story(self, tickers):
+        """
+        Invert match(): find which of the given tickers each story could mention.
+
+        Args:
+            tickers (list): Ticker symbols to look for
+
+        Returns:
+            dict: Story position mapped to the tickers it matched
+        """
+        candidates = {}
+        for ticker in tickers:
+            for position in self.match([ticker]):
+                candidates.setdefault(position, []).append(ticker)
+        return candidates
+
+    def select(self, tickers, excerpts=None):
+        """
+        The stories relevant to the given tickers.
+
+        Args:
+            tickers (list): Ticker symbols to look for
+            excerpts (dict): Optional story position -> {ticker: [excerpt]} from the
+                map phase. Stories with excerpts contribute only the passages about
+                these tickers; stories without an entry fall back to their full body.
+
+        Returns:
+            list: {"author", "body", "fingerprint"} dicts in their original order, where
+                the fingerprint is the full story's, whichever passages the body holds
+        """
+        selected = []
+        for position in self.match(tickers):
+            story = self.stories[position]
+            fingerprint = story_fingerprint(story['body'])
+            if excerpts is None or position not in excerpts:
+                selected.append({**story, "fingerprint": fingerprint})
+                continue
+
+            passages = []
+            for ticker in tickers:
+                for passage in excerpts[position].get(ticker, []):
+                    if passage not in passages:
+                        passages.append(passage)
+            if passages:
+                selected.append({"author": story['author'], "body": '\n'.join(passages), "fingerprint": fingerprint})
+        return selected
@@ -0,0 +1,139 @@
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+
+from services.portfolio import fetch_company_names, fetch_watermark, iter_portfolios
+from services.storage import CONTENT_STORE_URL, read_object, write_object
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Environment variables
+# Where the snapshot persists between instances, e.g. "gs://bucket/portfolios.json.gz";
+# next to the run corpora when a content store is configured, so cold instances find it
+SNAPSHOT_URL = os.environ.get(
+    "PORTFOLIO_SNAPSHOT_URL",
+    f"{CONTENT_STORE_URL.rstrip('/')}/portfolios.json.gz" if CONTENT_STORE_URL else "/tmp/duw-portfolios.json.gz",
+)
+# Rebuild at least this often even if the watermark never moves
+SNAPSHOT_MAX_AGE = int(os.environ.get("PORTFOLIO_SNAPSHOT_MAX_AGE", str(24 * 3600)))
+# Trust a snapshot this fresh without even checking the watermark; /invalidate-portfolios
+# forces a rebuild sooner
+SNAPSHOT_CHECK_INTERVAL = int(os.environ.get("PORTFOLIO_SNAPSHOT_CHECK_INTERVAL", "900"))
+
+SNAPSHOT_VERSION = 2
+
+_snapshot = None
+_lock = threading.Lock()
+
+
+def _serialize(snapshot):
+    return gzip.compress(json.dumps(snapshot, separators=(',', ':')).encode())
+
+
+def _deserialize(data):
+    snapshot = json.loads(gzip.decompress(data))
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        return None
+    return snapshot
+
+
+def _load_persisted():
+    try:
+        data = read_object(SNAPSHOT_URL)
+        return _deserialize(data) if data else None
+    except Exception as e:
+        logger.warning(f"[WARN] Ignoring unreadable portfolio snapshot at {SNAPSHOT_URL}: {e}")
+        return None
+
+
+def _refresh(watermark):
+    start = time.perf_counter()
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "watermark": watermark,
+        "refreshed_at": time.time(),
+        "users": [[email, portfolio] for user in iter_portfolios(raise_errors=True) for email, portfolio in user.items()],
+        "company_names": fetch_company_names(),
+    }
+    logger.info(f"[LOG] Rebuilt portfolio snapshot with {len(snapshot['users'])} users in {time.perf_counter() - start:.2f}s")
+
+    # Only persist snapshots we can validate later, so a failed watermark never looks current
+    if watermark is not None:
+        try:
+            write_object(SNAPSHOT_URL, _serialize(snapshot))
+        except Exception as e:
+            logger.warning(f"[WARN] Failed to persist portfolio snapshot to {SNAPSHOT_URL}: {e}")
+    return snapshot
+
+
+def load_portfolios():
+    """
+    Return every user's portfolios, from the cached snapshot while it is current.
+
+    The snapshot is kept in memory and persisted to PORTFOLIO_SNAPSHOT_URL so a
+    cold instance can load it without running the portfolio query. It is
+    trusted without touching the database for PORTFOLIO_SNAPSHOT_CHECK_INTERVAL
+    after it was built, then rebuilt when the database watermark moves, when it
+    is older than PORTFOLIO_SNAPSHOT_MAX_AGE, or after invalidate_snapshot().
+
+    Returns:
+        list: Same format as fetch_portfolios()
+    """
+    global _snapshot
+    with _lock:
+        if _snapshot is None:
+            _snapshot = _load_persisted()
+
+        now = time.time()
+        snapshot = _snapshot
+        if snapshot is not None and now - snapshot['refreshed_at'] < SNAPSHOT_CHECK_INTERVAL:
+            logger.info("[LOG] Using portfolio snapshot without checking the watermark")
+        else:
+            watermark = fetch_watermark()
+            current = (
+                snapshot is not None
+                and watermark is not None
+                and snapshot['watermark'] == watermark
+                and now - snapshot['refreshed_at'] < SNAPSHOT_MAX_AGE
+            )
+            if current:
+                logger.info("[LOG] Portfolio snapshot is current")
+            else:
+                try:
+                    snapshot = _snapshot = _refresh(watermark)
+                except Exception as e:
+                    if snapshot is None:
+                        logger.error(f"[ERROR] Failed to fetch portfolios: {e}")
+                        return []
+                    logger.error(f"[ERROR] Portfolio refresh failed, using the previous snapshot: {e}")
+
+        return [{email: portfolio} for email, portfolio in snapshot['users']]
+
+
+def load_company_names():
+    """
+    Company names of held tickers, as of the snapshot the last load_portfolios() returned.
+
+    Returns:
+        dict: Ticker mapped to company name
+    """
+    with _lock:
+        return dict(_snapshot['company_names']) if _snapshot is not None else {}
+
+
+def invalidate_snapshot():
+    """
+    Drop the cached snapshot, in memory and persisted, so the next load rebuilds it.
+    """
+    global _snapshot
+    with _lock:
+        _snapshot = None
+        try:
+            write_object(SNAPSHOT_URL, b'')
+        except Exception as e:
+            logger.warning(f"[WARN] Failed to clear persisted portfolio snapshot at {SNAPSHOT_URL}: {e}")
+    logger.info("[LOG] Portfolio snapshot invalidated")
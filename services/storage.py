@@ -0,0 +1,211 @@
+import gzip
+import hashlib
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Environment variables
+# Where shared run content is written, e.g. "gs://bucket/prefix" or "file:///tmp/duw-content".
+# Unset means tasks carry their content inline.
+CONTENT_STORE_URL = os.environ.get("CONTENT_STORE_URL")
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_storage_client():
+    """
+    Return the process-wide Cloud Storage client, creating it on first use.
+
+    Building a client resolves credentials, so it is done once rather than
+    for every ledger, cache and content store object touched.
+
+    Returns:
+        google.cloud.storage.Client: Shared client
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            from google.cloud import storage
+
+            _client = storage.Client()
+    return _client
+
+
+class ContentStore(ABC):
+    """
+    Write-once blob store addressed by the SHA-256 of the content.
+
+    Identical content always maps to the same key, so a blob is only uploaded
+    once however many tasks reference it, and readers can cache it forever.
+    Backends implement _exists, _write and _read.
+    """
+
+    def put(self, data):
+        """
+        Store content and return its key.
+
+        Args:
+            data (bytes): Content to store
+
+        Returns:
+            str: Hex SHA-256 of the content
+        """
+        key = hashlib.sha256(data).hexdigest()
+        if not self._exists(key):
+            self._write(key, gzip.compress(data))
+            logger.info(f"[LOG] Stored {len(data)} bytes of content under {key}")
+        return key
+
+    def get(self, key):
+        """
+        Fetch content previously stored with put().
+
+        Args:
+            key (str): Key returned by put()
+
+        Returns:
+            bytes: The stored content
+        """
+        data = gzip.decompress(self._read(key))
+        if hashlib.sha256(data).hexdigest() != key:
+            raise ValueError(f"Content for {key} is corrupt")
+        return data
+
+    @abstractmethod
+    def _exists(self, key):
+        raise NotImplementedError
+
+    @abstractmethod
+    def _write(self, key, blob):
+        raise NotImplementedError
+
+    @abstractmethod
+    def _read(self, key):
+        raise NotImplementedError
+
+
+class LocalContentStore(ContentStore):
+    """Content store on the local filesystem, for development and tests."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.gz")
+
+    def _exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def _write(self, key, blob):
+        # Write to a temporary name first so readers never see a partial blob
+        tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(blob)
+        os.replace(tmp_path, self._path(key))
+
+    def _read(self, key):
+        with open(self._path(key), 'rb') as f:
+            return f.read()
+
+
+class GCSContentStore(ContentStore):
+    """Content store in a Google Cloud Storage bucket, shared by every instance."""
+
+    def __init__(self, bucket, prefix=""):
+        self.bucket_name = bucket
+        self.prefix = prefix.strip('/')
+        self._bucket = None
+
+    @property
+    def bucket(self):
+        # Connect on first use so building the store at startup stays cheap
+        if self._bucket is None:
+            self._bucket = get_storage_client().bucket(self.bucket_name)
+        return self._bucket
+
+    def _blob(self, key):
+        name = f"{self.prefix}/{key}.gz" if self.prefix else f"{key}.gz"
+        return self.bucket.blob(name)
+
+    def _exists(self, key):
+        return self._blob(key).exists()
+
+    def _write(self, key, blob):
+        self._blob(key).upload_from_string(blob, content_type='application/gzip')
+
+    def _read(self, key):
+        return self._blob(key).download_as_bytes()
+
+
+def get_content_store(url=CONTENT_STORE_URL):
+    """
+    Build the content store configured by CONTENT_STORE_URL.
+
+    Args:
+        url (str): "gs://bucket/prefix", "file:///path", or a plain directory path
+
+    Returns:
+        ContentStore: Configured store, or None when no store is configured
+    """
+    if not url:
+        return None
+    if url.startswith('gs://'):
+        bucket, _, prefix = url[len('gs://'):].partition('/')
+        return GCSContentStore(bucket, prefix)
+    if url.startswith('file://'):
+        url = url[len('file://'):]
+    return LocalContentStore(url)
+
+
+def read_object(url):
+    """
+    Read a mutable object, such as a cache snapshot, from GCS or the local filesystem.
+
+    Args:
+        url (str): "gs://bucket/path", "file:///path", or a plain file path
+
+    Returns:
+        bytes: Object content, or None if it does not exist
+    """
+    if url.startswith('gs://'):
+        from google.api_core.exceptions import NotFound
+
+        bucket, _, name = url[len('gs://'):].partition('/')
+        # One round trip: asking whether the object exists first would double the calls
+        try:
+            return get_storage_client().bucket(bucket).blob(name).download_as_bytes()
+        except NotFound:
+            return None
+    if url.startswith('file://'):
+        url = url[len('file://'):]
+    if not os.path.exists(url):
+        return None
+    with open(url, 'rb') as f:
+        return f.read()
+
+
+def write_object(url, data):
+    """
+    Write a mutable object, replacing any previous version.
+
+    Args:
+        url (str): "gs://bucket/path", "file:///path", or a plain file path
+        data (bytes): Content to write
+    """
+    if url.startswith('gs://'):
+        bucket, _, name = url[len('gs://'):].partition('/')
+        get_storage_client().bucket(bucket).blob(name).upload_from_string(data)
+        return
+    if url.startswith('file://'):
+        url = url[len('file://'):]
+    os.makedirs(os.path.dirname(url) or '.', exist_ok=True)
+    tmp_path = f"{url}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, url)
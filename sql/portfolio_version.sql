@@ -0,0 +1,37 @@
+-- Change marker for the portfolio snapshot (services/snapshot.py).
+--
+-- A single row whose version is bumped by every statement that writes to a
+-- table behind PORTFOLIO_QUERY. Unlike pg_stat counters it survives Neon
+-- suspending the compute, so a cached snapshot stays valid until portfolios
+-- actually change. Run once against the Neon database.
+
+CREATE TABLE IF NOT EXISTS portfolio_version (
+    id boolean PRIMARY KEY DEFAULT true CHECK (id),
+    version bigint NOT NULL DEFAULT 0,
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+INSERT INTO portfolio_version (id) VALUES (true) ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_portfolio_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE portfolio_version SET version = version + 1, updated_at = now() WHERE id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER profiles_bump_portfolio_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON profiles
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_portfolio_version();
+
+CREATE OR REPLACE TRIGGER portfolios_bump_portfolio_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON portfolios
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_portfolio_version();
+
+CREATE OR REPLACE TRIGGER stocks_bump_portfolio_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON stocks
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_portfolio_version();
+
+CREATE OR REPLACE TRIGGER users_sync_bump_portfolio_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON neon_auth.users_sync
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_portfolio_version();
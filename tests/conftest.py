@@ -0,0 +1,27 @@
+import time
+
+import pytest
+
+# Where each storage backend keeps a fresh store, under a test's tmp_path
+STORE_URLS = {
+    "memory": lambda tmp_path: "memory",
+    "sqlite": lambda tmp_path: f"sqlite:///{tmp_path}/store.sqlite3",
+    "object_store": lambda tmp_path: f"file://{tmp_path}/store",
+}
+
+
+@pytest.fixture
+def store_url(request, tmp_path):
+    """
+    Location of a fresh store for each backend a test is parametrized over, e.g.
+    @pytest.mark.parametrize("store_url", ["sqlite", "object_store"], indirect=True)
+    """
+    return STORE_URLS[request.param](tmp_path)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Frozen time.time(); advance it with clock[0] += seconds."""
+    now = [1_000_000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
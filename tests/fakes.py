@@ -0,0 +1,131 @@
+"""
+Fakes for the pipeline's external services, shared by the tests and the
+benchmark stand-ins.
+"""
+import json
+import random
+import socketserver
+import ssl
+import threading
+import time
+from types import SimpleNamespace
+
+
+class RateLimitedError(Exception):
+    """429 from an LLM fake, carrying a Retry-After header like the real gateway."""
+
+    status_code = 429
+
+    def __init__(self, retry_after):
+        super().__init__(f"rate limited, retry after {retry_after:.2f}s")
+        self.response = SimpleNamespace(headers={"retry-after": f"{retry_after:.3f}"})
+
+
+class FakeLLMClient:
+    """
+    AsyncOpenAI stand-in that answers with the given replies in turn, raising
+    any that are exceptions, and repeats the last one once they run out.
+    """
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.calls = []
+        self.chat = SimpleNamespace(completions=self)
+
+    async def create(self, model, messages, **kwargs):
+        self.calls.append(time.monotonic())
+        reply = self.replies[min(len(self.calls), len(self.replies)) - 1]
+        if isinstance(reply, Exception):
+            raise reply
+        content = json.dumps(reply)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+
+class FakeSMTPSession:
+    """smtplib session whose sends fail with a given error, and whose quit fails like a dead TLS socket."""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.closed = False
+        self.sent = []
+
+    def send_message(self, msg):
+        if self.error:
+            raise self.error
+        self.sent.append(msg['To'])
+
+    def quit(self):
+        raise ssl.SSLEOFError("EOF occurred in violation of protocol")
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSMTPServer:
+    """
+    Minimal SMTP server on localhost with per-message latency and failures.
+
+    With drop_every set, the server hangs up right after accepting every
+    drop_every-th message of a session, the way Gmail closes long-lived
+    sessions, so the next message on that session hits a dead socket.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0, drop_every=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.drop_every = drop_every
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.sessions = 0
+        self.received = []
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(f"{line}\r\n".encode())
+
+            def handle(self):
+                with server._lock:
+                    server.sessions += 1
+                accepted = 0
+                recipients = []
+                self.reply("220 fake ready")
+                for raw in self.rfile:
+                    command = raw.decode(errors='replace').strip().upper()
+                    if command.startswith(('EHLO', 'HELO')):
+                        self.reply("250 fake")
+                    elif command.startswith('MAIL'):
+                        recipients = []
+                        self.reply("250 OK")
+                    elif command.startswith('RCPT'):
+                        recipients.append(raw.decode().split(':', 1)[1].strip().strip('<>'))
+                        self.reply("250 OK")
+                    elif command == 'DATA':
+                        self.reply("354 end with .")
+                        size = sum(len(line) for line in iter(self.rfile.readline, b'.\r\n'))
+                        time.sleep(server.latency)
+                        with server._lock:
+                            failed = server._random.random() < server.error_rate
+                            if not failed:
+                                server.received.extend((recipient, size) for recipient in recipients)
+                        if failed:
+                            self.reply("554 injected SMTP failure")
+                            continue
+                        self.reply("250 OK")
+                        accepted += 1
+                        if server.drop_every and accepted % server.drop_every == 0:
+                            return
+                    elif command == 'QUIT':
+                        self.reply("221 bye")
+                        return
+                    else:
+                        self.reply("250 OK")
+
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.host, self.port = self._server.server_address
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,107 @@
+import sqlite3
+
+import pytest
+
+from services import llm
+from tests.fakes import FakeLLMClient
+from utils import metrics
+
+
+ALL_BACKENDS = pytest.mark.parametrize("store_url", ["memory", "sqlite", "object_store"], indirect=True)
+
+
+@ALL_BACKENDS
+def test_round_trip_and_hit_counters(store_url, clock):
+    cache = llm.open_completion_cache(store_url)
+    metrics.reset()
+    assert cache.get("k", "compose") is None
+    cache.put("k", {"title": "t", "body": "b"})
+    assert cache.get("k", "compose") == {"title": "t", "body": "b"}
+    assert metrics.total("llm_cache_requests_total", {"kind": "compose", "result": "hit"}) == 1
+    assert metrics.total("llm_cache_requests_total", {"kind": "compose", "result": "miss"}) == 1
+
+
+@ALL_BACKENDS
+def test_entries_expire_after_ttl(store_url, clock):
+    cache = llm.open_completion_cache(store_url, ttl=60)
+    cache.put("k", {"v": 1})
+    clock[0] += 59
+    assert cache.get("k", "compose") == {"v": 1}
+    clock[0] += 2
+    assert cache.get("k", "compose") is None
+
+
+# The object store is bounded by a bucket lifecycle rule instead
+@pytest.mark.parametrize("store_url", ["memory", "sqlite"], indirect=True)
+def test_least_recently_used_entry_is_evicted(store_url, clock):
+    cache = llm.open_completion_cache(store_url, max_entries=2)
+    cache.put("a", {"v": "a"})
+    clock[0] += 1
+    cache.put("b", {"v": "b"})
+    clock[0] += 1
+    # Reading "a" makes "b" the least recently used
+    assert cache.get("a", "compose") == {"v": "a"}
+    clock[0] += 1
+    cache.put("c", {"v": "c"})
+
+    assert cache.get("b", "compose") is None
+    assert cache.get("a", "compose") == {"v": "a"}
+    assert cache.get("c", "compose") == {"v": "c"}
+
+
+def test_sqlite_cache_survives_reopening(tmp_path, clock):
+    path = str(tmp_path / "cache.sqlite3")
+    llm.SQLiteCompletionCache(path, ttl=60).put("k", {"v": 1})
+    assert llm.SQLiteCompletionCache(path, ttl=60).get("k", "compose") == {"v": 1}
+    clock[0] += 61
+    # Expired entries are purged when the cache is opened
+    llm.SQLiteCompletionCache(path, ttl=60)
+    # Rewind, so only the purge and not the read's own expiry check can hide it
+    clock[0] -= 61
+    assert llm.SQLiteCompletionCache(path, ttl=60).get("k", "compose") is None
+
+
+def test_cache_key_is_order_and_input_sensitive():
+    assert llm.cache_key("compose", "m", 1, ["AAPL", "NVDA"]) == llm.cache_key("compose", "m", 1, ["AAPL", "NVDA"])
+    assert llm.cache_key("compose", "m", 1, ["AAPL"]) != llm.cache_key("compose", "m", 2, ["AAPL"])
+    assert llm.cache_key("compose", "m", 1) != llm.cache_key("extract", "m", 1)
+
+
+async def test_call_llm_reuses_cached_newsletter(monkeypatch):
+    client = FakeLLMClient({"title": "NVDA", "body": "## NVDA\nShares rose."})
+    monkeypatch.setattr(llm, "_completion_cache", llm.MemoryCompletionCache())
+    monkeypatch.setattr(llm, "_rate_limiter", llm.RateLimiter(0, 0))
+    monkeypatch.setattr(llm, "create_openai_client", lambda: client)
+
+    first = await llm.call_llm(["NVDA"], "NVDA rose")
+    second = await llm.call_llm(["NVDA"], "NVDA rose")
+    assert first == second == {"title": "NVDA", "body": "## NVDA\nShares rose."}
+    assert len(client.calls) == 1
+
+    await llm.call_llm(["NVDA"], "NVDA fell")
+    assert len(client.calls) == 2
+
+
+async def test_call_llm_does_not_cache_failures(monkeypatch):
+    client = FakeLLMClient(None)
+    monkeypatch.setattr(llm, "_completion_cache", llm.MemoryCompletionCache())
+    monkeypatch.setattr(llm, "_rate_limiter", llm.RateLimiter(0, 0))
+    monkeypatch.setattr(llm, "create_openai_client", lambda: client)
+    monkeypatch.setattr(llm, "LLM_MAX_RETRIES", 1)
+
+    assert await llm.call_llm(["NVDA"], "NVDA rose") == {"title": "title of the newsletter", "body": "", "incomplete": True}
+    await llm.call_llm(["NVDA"], "NVDA rose")
+    assert len(client.calls) == 2
+
+
+def test_sqlite_cache_drops_expired_entries_on_write(tmp_path, clock):
+    cache = llm.SQLiteCompletionCache(str(tmp_path / "cache.sqlite3"), ttl=60)
+    cache.put("old", {"v": 1})
+    clock[0] += 61
+    cache.put("new", {"v": 2})
+
+    conn = sqlite3.connect(cache.path)
+    try:
+        assert [row[0] for row in conn.execute("SELECT key FROM completions")] == ["new"]
+    finally:
+        conn.close()
@@ -0,0 +1,64 @@
+from services.corpus import compact_emails, minhash_signature, normalize_body, similarity, story_fingerprint
+
+STORY = (
+    "Nvidia told suppliers Samsung and Amkor to stop production related to its H20 chip after Beijing "
+    "urged local firms to avoid it, and shares slipped 2% in early trading as analysts cut estimates for the quarter."
+)
+FOOTER = (
+    "<p>Follow us on X and LinkedIn</p>"
+    "<p>You are receiving this email because you subscribed. <a href='https://x.test/u'>Unsubscribe</a></p>"
+    "<p>© 2025 Acme Media. All rights reserved.</p>"
+    "<p>Privacy policy | Terms of service</p>"
+)
+
+
+def test_normalize_body_keeps_news_that_mentions_footer_phrases():
+    body = (
+        "Meta updated its privacy policy to let it train AI on user posts, shares fell 3%.\n"
+        "Regulators said the new terms of service may breach EU rules, and all rights reserved by users remain unclear.\n"
+        "Copyright lawsuits against OpenAI mounted as authors sought damages.\n"
+        "Follow us on X for updates, the company told investors after the call.\n"
+    )
+    assert normalize_body(body) == body.strip()
+
+
+def test_normalize_body_strips_html_links_and_footer():
+    text = normalize_body(f"<html><head><style>p {{color: red}}</style></head><p>{STORY} https://example.com/story</p>{FOOTER}</html>")
+    assert text == STORY
+
+
+def test_normalize_body_strips_chrome_above_the_story():
+    text = normalize_body(f"<p>View this email in your browser</p><p>{STORY}</p>")
+    assert text == STORY
+
+
+def test_long_chrome_paragraph_is_kept():
+    # A chrome phrase inside a paragraph of news does not make it chrome
+    paragraph = "Readers can unsubscribe from the feature " + "while regulators review the change " * 4
+    assert normalize_body(paragraph) == paragraph.strip()
+
+
+def test_similarity_of_near_duplicates():
+    reprint = STORY + " Reprinted with permission."
+    assert similarity(minhash_signature(STORY), minhash_signature(reprint)) >= 0.8
+    assert similarity(minhash_signature(STORY), minhash_signature("Apple is exploring Google Gemini to power a revamped Siri, people familiar said.")) < 0.2
+    assert minhash_signature("too short") == []
+
+
+def test_compact_emails_drops_exact_and_near_duplicates():
+    other = "Apple is exploring using Google Gemini AI to power a revamped Siri, according to people familiar with the talks on Friday."
+    emails = [
+        {"from": "Bloomberg", "body": f"<p>{STORY}</p>{FOOTER}"},
+        {"from": "Wire copy", "body": f"<p>{STORY}</p>"},
+        {"from": "Syndicate", "body": f"<p>{STORY}</p><p>Reprinted with permission.</p>"},
+        {"from": "WSJ", "body": other},
+        {"from": "Empty", "body": FOOTER},
+    ]
+    kept = compact_emails(emails)
+    assert kept == [{"from": "Bloomberg", "body": STORY}, {"from": "WSJ", "body": other}]
+
+
+def test_story_fingerprint_ignores_case_and_whitespace():
+    assert story_fingerprint("Nvidia  rallied.\nShares rose") == story_fingerprint("nvidia rallied shares ROSE")
+    assert story_fingerprint("Nvidia rallied") != story_fingerprint("Nvidia fell")
+    assert len(story_fingerprint(STORY)) == 16
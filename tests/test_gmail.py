@@ -0,0 +1,102 @@
+import smtplib
+import ssl
+
+from services.gmail import GmailSender, build_html_message, is_permanent_failure
+from tests.fakes import FakeSMTPServer, FakeSMTPSession
+
+
+def messages(count):
+    return [build_html_message("<p>hi</p>", "hi", f"user{i}@example.com") for i in range(count)]
+
+
+def local_sender(server, **kwargs):
+    return GmailSender(user=None, password=None, host=server.host, port=server.port, use_ssl=False, **kwargs)
+
+
+def test_send_many_reuses_pooled_session():
+    server = FakeSMTPServer()
+    sender = local_sender(server)
+    try:
+        assert sender.send_many(messages(3)) == []
+        assert sender.send_many(messages(3)) == []
+        assert server.sessions == 1
+        assert len(server.received) == 6
+    finally:
+        sender.close()
+        server.close()
+
+
+def test_send_many_reconnects_after_server_hangs_up():
+    server = FakeSMTPServer(drop_every=2)
+    sender = local_sender(server)
+    try:
+        assert sender.send_many(messages(5)) == []
+        assert [recipient for recipient, _ in server.received] == [f"user{i}@example.com" for i in range(5)]
+        assert server.sessions == 3
+    finally:
+        sender.close()
+        server.close()
+
+
+def test_rejected_message_keeps_session():
+    server = FakeSMTPServer(error_rate=1.0)
+    sender = local_sender(server)
+    try:
+        failures = sender.send_many(messages(2))
+        assert len(failures) == 2
+        assert server.sessions == 1
+        assert sender._idle.qsize() == 1
+    finally:
+        sender.close()
+        server.close()
+
+
+def test_tls_error_reconnects_and_never_pools_dead_session():
+    sender = GmailSender(user=None, password=None)
+    dead = FakeSMTPSession(ssl.SSLEOFError("EOF occurred in violation of protocol"))
+    fresh = FakeSMTPSession()
+    sender._idle.put(dead)
+    sender._connect = lambda: fresh
+
+    assert sender.send_many(messages(3)) == []
+    assert dead.closed
+    assert fresh.sent == ["user0@example.com", "user1@example.com", "user2@example.com"]
+    assert sender._idle.get_nowait() is fresh
+    assert sender._idle.empty()
+
+
+def test_failed_reconnect_leaves_pool_empty():
+    sender = GmailSender(user=None, password=None)
+    sessions = []
+
+    def connect():
+        sessions.append(FakeSMTPSession(OSError("connection reset")))
+        return sessions[-1]
+
+    sender._connect = connect
+
+    failures = sender.send_many(messages(2))
+    assert len(failures) == 2
+    assert all(isinstance(error, OSError) for _, error in failures)
+    assert all(session.closed for session in sessions)
+    assert sender._idle.empty()
+
+
+def test_unexpected_error_discards_session():
+    sender = GmailSender(user=None, password=None)
+    broken = FakeSMTPSession(ValueError("bad header"))
+    sender._idle.put(broken)
+
+    failures = sender.send_many(messages(1))
+    assert len(failures) == 1
+    assert broken.closed
+    assert sender._idle.empty()
+
+
+def test_rejections_are_permanent_and_connection_errors_transient():
+    assert is_permanent_failure(smtplib.SMTPRecipientsRefused({"a@example.com": (550, b"no such user")}))
+    assert not is_permanent_failure(smtplib.SMTPRecipientsRefused({"a@example.com": (450, b"greylisted")}))
+    assert is_permanent_failure(smtplib.SMTPDataError(554, b"rejected"))
+    assert not is_permanent_failure(smtplib.SMTPDataError(421, b"try again later"))
+    assert not is_permanent_failure(smtplib.SMTPServerDisconnected("gone"))
+    assert not is_permanent_failure(ssl.SSLEOFError("EOF occurred in violation of protocol"))
@@ -0,0 +1,93 @@
+import pytest
+
+from services.ledger import ObjectStoreLedger, SQLiteLedger, is_shared_ledger, job_key, open_ledger
+
+
+BOTH_BACKENDS = pytest.mark.parametrize("store_url", ["sqlite", "object_store"], indirect=True)
+
+
+@BOTH_BACKENDS
+def test_deliveries_are_scoped_to_the_run(store_url):
+    ledger = open_ledger(store_url)
+    assert not ledger.is_delivered("run-1", "a@example.com")
+
+    ledger.mark_delivered("run-1", "a@example.com")
+    ledger.mark_delivered("run-1", "a@example.com")
+    assert ledger.is_delivered("run-1", "a@example.com")
+    assert not ledger.is_delivered("run-1", "b@example.com")
+    assert not ledger.is_delivered("run-2", "a@example.com")
+
+
+@BOTH_BACKENDS
+def test_artifacts_round_trip_per_stage(store_url):
+    ledger = open_ledger(store_url)
+    key = job_key(["NVDA"], "stories")
+    assert ledger.get_artifact("run", key, "pdf") is None
+
+    ledger.put_artifact("run", key, "letter", b'{"title": "t"}')
+    ledger.put_artifact("run", key, "pdf", b"%PDF-1")
+    ledger.put_artifact("run", key, "pdf", b"%PDF-2")
+    assert ledger.get_artifact("run", key, "letter") == b'{"title": "t"}'
+    assert ledger.get_artifact("run", key, "pdf") == b"%PDF-2"
+    assert ledger.get_artifact("other-run", key, "pdf") is None
+
+
+@BOTH_BACKENDS
+def test_seen_stories_accumulate_per_recipient(store_url):
+    ledger = open_ledger(store_url)
+    assert ledger.seen_stories("a@example.com") == set()
+
+    ledger.mark_seen("a@example.com", ["f1", "f2"])
+    ledger.mark_seen("a@example.com", ["f2", "f3"])
+    assert ledger.seen_stories("a@example.com") == {"f1", "f2", "f3"}
+    assert ledger.seen_stories("b@example.com") == set()
+
+
+@BOTH_BACKENDS
+def test_seen_stories_expire(store_url, clock):
+    ledger = open_ledger(store_url, seen_retention_seconds=60)
+    ledger.mark_seen("a@example.com", ["old"])
+
+    clock[0] += 120
+    ledger.mark_seen("a@example.com", ["new"])
+    # SQLite prunes on open, the object store on read
+    ledger = open_ledger(store_url, seen_retention_seconds=60)
+    assert ledger.seen_stories("a@example.com") == {"new"}
+
+
+def test_object_store_ledger_hashes_addresses(tmp_path):
+    ledger = ObjectStoreLedger(f"file://{tmp_path}")
+    ledger.mark_delivered("run", "a@example.com")
+    ledger.mark_seen("a@example.com", ["f1"])
+    names = [str(path) for path in tmp_path.rglob("*")]
+    assert names and not any("example.com" in name for name in names)
+
+
+def test_job_key_depends_on_tickers_and_stories_only():
+    assert job_key(["NVDA", "AAPL"], "s") == job_key(["AAPL", "NVDA"], "s")
+    assert job_key(["NVDA"], "s") != job_key(["NVDA"], "t")
+    assert job_key(["NVDA"], "s") != job_key(["AAPL"], "s")
+
+
+def test_only_gcs_ledgers_are_shared_by_default():
+    assert not is_shared_ledger("sqlite:////tmp/ledger.sqlite3")
+    assert not is_shared_ledger("file:///tmp/duw-ledger")
+    assert not is_shared_ledger("/tmp/duw-ledger")
+    assert is_shared_ledger("gs://bucket/ledger")
+    assert is_shared_ledger("file:///mnt/shared/ledger", shared=True)
+
+
+def test_sqlite_ledger_prunes_expired_records_on_write(tmp_path, clock):
+    ledger = SQLiteLedger(str(tmp_path / "ledger.sqlite3"), retention_seconds=100, prune_interval=60)
+    ledger.put_artifact("old-run", "key", "pdf", b"%PDF")
+    ledger.mark_delivered("old-run", "a@example.com")
+
+    clock[0] += 30
+    ledger.put_artifact("new-run", "key", "pdf", b"%PDF")
+    assert ledger.get_artifact("old-run", "key", "pdf") == b"%PDF"
+
+    clock[0] += 90
+    ledger.mark_delivered("new-run", "a@example.com")
+    assert ledger.get_artifact("old-run", "key", "pdf") is None
+    assert not ledger.is_delivered("old-run", "a@example.com")
+    assert ledger.get_artifact("new-run", "key", "pdf") == b"%PDF"
@@ -0,0 +1,124 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from services import llm
+from tests.fakes import FakeLLMClient, RateLimitedError
+from utils import metrics
+
+
+async def hold(scheduler, name, order, priority=llm.PRIORITY_COMPOSE, seconds=0.0, in_flight=None):
+    async with scheduler.slot(1, priority):
+        order.append(name)
+        if in_flight is not None:
+            in_flight.append(1)
+            in_flight[0] = max(in_flight[0], len(in_flight) - 1)
+        await asyncio.sleep(seconds)
+        if in_flight is not None:
+            in_flight.pop()
+
+
+async def test_scheduler_admits_by_priority_then_arrival():
+    scheduler = llm.LLMScheduler(llm.RateLimiter(0, 0), max_concurrency=1)
+    order = []
+    blocker = asyncio.create_task(hold(scheduler, "blocker", order, seconds=0.05))
+    await asyncio.sleep(0)
+
+    waiting = [
+        asyncio.create_task(hold(scheduler, "compose-1", order)),
+        asyncio.create_task(hold(scheduler, "extract-1", order, llm.PRIORITY_EXTRACTION)),
+        asyncio.create_task(hold(scheduler, "compose-2", order)),
+        asyncio.create_task(hold(scheduler, "extract-2", order, llm.PRIORITY_EXTRACTION)),
+    ]
+    await asyncio.gather(blocker, *waiting)
+    assert order == ["blocker", "extract-1", "extract-2", "compose-1", "compose-2"]
+
+
+async def test_scheduler_caps_requests_in_flight():
+    scheduler = llm.LLMScheduler(llm.RateLimiter(0, 0), max_concurrency=2)
+    order = []
+    # First element tracks the peak, the rest one marker per request in flight
+    in_flight = [0]
+    await asyncio.gather(*(hold(scheduler, i, order, seconds=0.02, in_flight=in_flight) for i in range(6)))
+    assert sorted(order) == list(range(6))
+    assert in_flight == [2]
+
+
+async def test_pause_holds_back_every_caller():
+    limiter = llm.RateLimiter(0, 0)
+    scheduler = llm.LLMScheduler(limiter)
+    limiter.pause(0.1)
+    assert limiter.try_acquire(1) == pytest.approx(0.1, abs=0.02)
+
+    start = time.monotonic()
+    await asyncio.gather(*(hold(scheduler, i, []) for i in range(3)))
+    assert time.monotonic() - start >= 0.09
+
+
+def test_retry_after_headers():
+    def error(headers):
+        return SimpleNamespace(response=SimpleNamespace(headers=headers))
+
+    assert llm._retry_after(error({"retry-after": "1.5"})) == 1.5
+    assert llm._retry_after(error({"retry-after-ms": "250", "retry-after": "9"})) == 0.25
+    assert llm._retry_after(error({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0.0
+    assert llm._retry_after(error({"retry-after": "soon"})) is None
+    assert llm._retry_after(error({})) is None
+    assert llm._retry_after(ValueError("no response")) is None
+
+
+def test_backoff_uses_server_hint_or_jittered_exponential(monkeypatch):
+    monkeypatch.setattr(llm, "LLM_BACKOFF_BASE", 1.0)
+    monkeypatch.setattr(llm, "LLM_BACKOFF_MAX", 8.0)
+    assert 3.0 <= llm._backoff(0, retry_after=3.0) <= 4.0
+    assert 0.5 <= llm._backoff(0) <= 1.0
+    assert 2.0 <= llm._backoff(2) <= 4.0
+    assert 4.0 <= llm._backoff(10) <= 8.0
+
+
+async def test_rate_limited_call_pauses_limiter_and_retries(monkeypatch):
+    limiter = llm.RateLimiter(0, 0)
+    # Answers 429 with a Retry-After the first time, then succeeds
+    client = FakeLLMClient(RateLimitedError(0.1), {"title": "t", "body": "b"})
+    monkeypatch.setattr(llm, "_rate_limiter", limiter)
+    monkeypatch.setattr(llm, "create_openai_client", lambda: client)
+    monkeypatch.setattr(llm, "LLM_BACKOFF_BASE", 0.01)
+    metrics.reset()
+
+    assert await llm._complete_json("prompt", None, "model", "test") == {"title": "t", "body": "b"}
+    assert len(client.calls) == 2
+    assert client.calls[1] - client.calls[0] >= 0.1
+    assert limiter.paused_until > 0
+    assert metrics.total("llm_requests_total", {"model": "model", "outcome": "rate_limited"}) == 1
+    assert metrics.total("llm_requests_total", {"model": "model", "outcome": "ok"}) == 1
+
+
+def test_request_larger_than_bucket_is_let_through_into_debt():
+    # 600 tokens a minute is 10 a second, so the bucket holds 10
+    bucket = llm.TokenBucket(600)
+    now = bucket.updated
+    assert bucket.capacity == 10
+
+    assert bucket.wait_time(50, now) == 0.0
+    bucket.take(50)
+    assert bucket.level == -40
+    # The debt is paid off before even a small request is admitted
+    assert bucket.wait_time(1, now) == pytest.approx(4.1)
+    assert bucket.wait_time(1, now + 4.1) == pytest.approx(0.0)
+
+
+def test_oversized_request_waits_for_a_full_bucket():
+    bucket = llm.TokenBucket(600)
+    now = bucket.updated
+    bucket.take(5)
+    assert bucket.wait_time(50, now) == pytest.approx(0.5)
+
+
+def test_limiter_settles_actual_usage():
+    limiter = llm.RateLimiter(0, 600)
+    assert limiter.try_acquire(5) == 0.0
+    limiter.settle(estimated=5, actual=25)
+    assert limiter.tokens.level == pytest.approx(-15, abs=0.1)
+    assert limiter.try_acquire(1) > 1.0
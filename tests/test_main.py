@@ -0,0 +1,244 @@
+import smtplib
+from concurrent.futures import Future
+
+import pytest
+
+import main
+from services.corpus import story_fingerprint
+from services.ledger import SQLiteLedger, job_key
+from services.portfolio import SubscriberIndex
+from services.tasks import InMemoryDispatcher
+from utils import generatepdf
+
+
+class RecordingSender:
+    def __init__(self):
+        self.sent = []
+        self.errors = {}
+
+    def send_many(self, messages):
+        self.sent.extend(msg['To'] for msg in messages if msg['To'] not in self.errors)
+        return [(msg, self.errors[msg['To']]) for msg in messages if msg['To'] in self.errors]
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    ledger = SQLiteLedger(str(tmp_path / "ledger.sqlite3"))
+    sender = RecordingSender()
+    monkeypatch.setattr(main, "get_ledger", lambda: ledger)
+    monkeypatch.setattr(main, "get_sender", lambda: sender)
+
+    def submit_render(letter):
+        future = Future()
+        future.set_result(generatepdf.render_pdf(letter))
+        return future
+
+    monkeypatch.setattr(generatepdf, "submit_render", submit_render)
+    return ledger, sender
+
+
+async def test_successful_letter_and_pdf_are_kept_for_retries(pipeline, monkeypatch):
+    ledger, sender = pipeline
+
+    async def call_llm(tickers, stories):
+        return {"title": "NVDA", "body": "## NVDA\nShares rose."}
+
+    monkeypatch.setattr(main, "call_llm", call_llm)
+    results = await main.generate_and_send_newsletter(["a@example.com"], ["NVDA"], "NVDA rose", run_id="run")
+
+    assert results == [{"email": "a@example.com", "status": "sent"}]
+    assert sender.sent == ["a@example.com"]
+    key = job_key(["NVDA"], "NVDA rose")
+    assert ledger.get_artifact("run", key, "letter") is not None
+    assert ledger.get_artifact("run", key, "pdf").startswith(b"%PDF")
+    assert ledger.is_delivered("run", "a@example.com")
+
+
+async def test_failed_llm_fallback_is_not_kept_for_retries(pipeline, monkeypatch):
+    ledger, _ = pipeline
+
+    async def call_llm(tickers, stories):
+        return {"title": "title of the newsletter", "body": "", "incomplete": True}
+
+    monkeypatch.setattr(main, "call_llm", call_llm)
+    await main.generate_and_send_newsletter(["a@example.com"], ["NVDA"], "NVDA rose", run_id="run", fingerprints=["f1"])
+
+    key = job_key(["NVDA"], "NVDA rose")
+    assert ledger.get_artifact("run", key, "letter") is None
+    assert ledger.get_artifact("run", key, "pdf") is None
+    assert ledger.seen_stories("a@example.com") == set()
+
+
+@pytest.mark.parametrize("letter", [
+    {"title": "NVDA", "body": "## NVDA\nShares rose.", "incomplete": True},
+    {"title": "NVDA", "body": ""},
+])
+async def test_stories_are_only_seen_after_a_complete_letter_with_a_body(pipeline, monkeypatch, letter):
+    ledger, sender = pipeline
+
+    async def call_llm(tickers, stories):
+        return letter
+
+    monkeypatch.setattr(main, "call_llm", call_llm)
+    results = await main.generate_and_send_newsletter(["a@example.com"], ["NVDA"], "NVDA rose", run_id="run", fingerprints=["f1"])
+
+    assert results == [{"email": "a@example.com", "status": "sent"}]
+    assert ledger.seen_stories("a@example.com") == set()
+
+
+STORIES = [
+    {"author": "Wire", "body": "NVDA rose after earnings.", "fingerprint": "f1"},
+    {"author": "Desk", "body": "NVDA suppliers were told to halt production.", "fingerprint": "f2"},
+]
+
+
+def test_split_by_unseen_groups_recipients_by_what_they_have_not_seen(pipeline):
+    ledger, _ = pipeline
+    ledger.mark_seen("old@example.com", ["f1"])
+    ledger.mark_seen("done@example.com", ["f1", "f2"])
+
+    groups = main.split_by_unseen(ledger, ["new@example.com", "old@example.com", "done@example.com", "new2@example.com"], STORIES)
+    assert groups == [
+        (["new@example.com", "new2@example.com"], STORIES),
+        (["old@example.com"], STORIES[1:]),
+        (["done@example.com"], []),
+    ]
+
+
+def test_item_fingerprints_fall_back_to_the_body():
+    assert main.item_fingerprints([{"author": "Wire", "body": "NVDA rose."}]) == [story_fingerprint("NVDA rose.")]
+
+
+@pytest.mark.parametrize("policy,caught_up_status", [("notice", "sent"), ("skip", "skipped")])
+async def test_incremental_run_sends_only_unseen_stories(pipeline, monkeypatch, policy, caught_up_status):
+    ledger, sender = pipeline
+    prompts = []
+
+    async def call_llm(tickers, stories):
+        prompts.append(stories)
+        return {"title": "NVDA", "body": "## NVDA\nNews."}
+
+    monkeypatch.setattr(main, "call_llm", call_llm)
+    monkeypatch.setattr(main, "INCREMENTAL_NEWSLETTERS", True)
+    monkeypatch.setattr(main, "UNAFFECTED_POLICY", policy)
+    ledger.mark_seen("b@example.com", ["f1"])
+    ledger.mark_seen("c@example.com", ["f1", "f2"])
+    job = {"emails": ["a@example.com", "b@example.com", "c@example.com"], "tickers": ["NVDA"], "items": STORIES}
+
+    results = {result['email']: result['status'] for result in await main.process_jobs([job], run_id="run")}
+    assert results == {"a@example.com": "sent", "b@example.com": "sent", "c@example.com": caught_up_status}
+    assert sorted(prompts) == sorted([main.format_stories(STORIES), main.format_stories(STORIES[1:])])
+    assert ledger.seen_stories("a@example.com") == ledger.seen_stories("b@example.com") == {"f1", "f2"}
+    assert ("c@example.com" in sender.sent) == (policy == "notice")
+
+    # The next run has nothing new for anyone
+    prompts.clear()
+    await main.process_jobs([job], run_id="run-2")
+    assert prompts == []
+
+
+def task(age_ms, run_id="run"):
+    timestamp = int(main.time.time() * 1000) - age_ms
+    return {"run_id": run_id, "timestamp": timestamp, "jobs": [{"emails": ["a@example.com"], "tickers": ["NVDA"], "stories": ""}]}
+
+
+def test_old_task_is_dropped_with_local_ledger(pipeline, monkeypatch):
+    monkeypatch.setattr(main, "TASK_MAX_AGE_MS", 1000)
+    client = main.create_app("worker").test_client()
+
+    response = client.post('/worker', json=task(5000))
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == "DROPPED_OLD_TASK"
+
+
+def test_old_task_runs_with_shared_ledger_but_not_without_run_id(pipeline, monkeypatch):
+    _, sender = pipeline
+    monkeypatch.setattr(main, "TASK_MAX_AGE_MS", 1000)
+    monkeypatch.setattr(main, "is_shared_ledger", lambda: True)
+    client = main.create_app("worker").test_client()
+
+    assert client.post('/worker', json=task(5000, run_id=None)).get_data(as_text=True) == "DROPPED_OLD_TASK"
+    response = client.post('/worker', json=task(5000))
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "completed"
+    assert sender.sent == ["a@example.com"]
+
+
+@pytest.mark.parametrize("error,shared,status", [
+    (smtplib.SMTPServerDisconnected("gone"), True, 500),
+    (smtplib.SMTPServerDisconnected("gone"), False, 200),
+    (smtplib.SMTPRecipientsRefused({"a@example.com": (550, b"no such user")}), True, 200),
+])
+def test_worker_only_asks_for_retries_that_can_help(pipeline, monkeypatch, error, shared, status):
+    _, sender = pipeline
+    sender.errors["a@example.com"] = error
+    monkeypatch.setattr(main, "is_shared_ledger", lambda: shared)
+    client = main.create_app("worker").test_client()
+
+    response = client.post('/worker', json=task(0))
+    assert response.status_code == status
+    assert response.get_json()["status"] == "partial"
+    [result] = response.get_json()["results"]
+    assert result["retryable"] == (status == 500 or not shared)
+
+
+def test_pack_jobs_caps_count_and_bytes():
+    jobs = [{"emails": [f"user{i}@example.com"], "tickers": ["NVDA"], "items": [{"author": "Wire", "body": "x" * 100}]} for i in range(5)]
+    job_bytes = len(main.json.dumps(jobs[0]))
+
+    assert [len(batch) for batch in main.pack_jobs(jobs, max_jobs=2, max_bytes=10 * job_bytes)] == [2, 2, 1]
+    assert [len(batch) for batch in main.pack_jobs(jobs, max_jobs=10, max_bytes=2 * job_bytes + 1)] == [2, 2, 1]
+    # A job over the budget on its own still goes out, alone
+    assert [len(batch) for batch in main.pack_jobs(jobs, max_jobs=10, max_bytes=10)] == [1, 1, 1, 1, 1]
+    assert [job for batch in main.pack_jobs(jobs, max_jobs=3) for job in batch] == jobs
+
+
+def test_orchestrator_sends_notices_only_to_users_with_tickers(monkeypatch):
+    dispatcher = InMemoryDispatcher()
+    portfolios = [
+        {"nvda@x.com": {"p": ["NVDA"]}},
+        {"aapl@x.com": {"p": ["AAPL"]}},
+        {"empty@x.com": {}},
+        {"noacct@x.com": {"p": []}},
+    ]
+    monkeypatch.setattr(main, "task_dispatcher", dispatcher)
+    monkeypatch.setattr(main, "load_portfolios", lambda: portfolios)
+    monkeypatch.setattr(main, "subscriber_index", SubscriberIndex())
+    monkeypatch.setattr(main, "content_store", None)
+    monkeypatch.setattr(main, "STORY_EXTRACTION", False)
+    monkeypatch.setattr(main, "UNAFFECTED_POLICY", "notice")
+    story = "NVDA shares rose after the chipmaker raised its forecast for data center revenue again this quarter."
+    client = main.create_app("orchestrator").test_client()
+
+    response = client.post('/generate-newsletters', json={"emails": [{"from": "Wire", "body": story}]})
+    assert response.status_code == 200
+    assert response.get_json()["unaffected"] == 1
+    jobs = [job for task in dispatcher.tasks for job in task["jobs"]]
+    assert sorted(email for job in jobs for email in job["emails"]) == ["aapl@x.com", "nvda@x.com"]
+    assert [job["emails"] for job in jobs if job.get("notice")] == [["aapl@x.com"]]
+
+
+def test_orchestrator_reports_tasks_it_could_not_create(monkeypatch):
+    class FailingDispatcher(InMemoryDispatcher):
+        def _create_task(self, payload, task_id=None):
+            if "aapl@x.com" in [email for job in payload["jobs"] for email in job["emails"]]:
+                raise ConnectionError("queue unavailable")
+            return super()._create_task(payload, task_id)
+
+    monkeypatch.setattr(main, "task_dispatcher", FailingDispatcher(max_retries=1))
+    monkeypatch.setattr(main, "load_portfolios", lambda: [{"nvda@x.com": {"p": ["NVDA"]}}, {"aapl@x.com": {"p": ["AAPL"]}}])
+    monkeypatch.setattr(main, "subscriber_index", SubscriberIndex())
+    monkeypatch.setattr(main, "content_store", None)
+    monkeypatch.setattr(main, "STORY_EXTRACTION", False)
+    monkeypatch.setattr(main, "UNAFFECTED_POLICY", "notice")
+    # One job per task, so only the notice task fails
+    monkeypatch.setattr(main, "WORKER_BATCH_SIZE", 1)
+    story = "NVDA shares rose after the chipmaker raised its forecast for data center revenue again this quarter."
+    client = main.create_app("orchestrator").test_client()
+
+    response = client.post('/generate-newsletters', json={"emails": [{"from": "Wire", "body": story}]})
+    assert response.status_code == 207
+    body = response.get_json()
+    assert body["count"] == 1
+    assert [failure["emails"] for failure in body["failed"]] == [["aapl@x.com"]]
+    assert [task["run_id"] for task in main.task_dispatcher.tasks] == [body["run_id"]]
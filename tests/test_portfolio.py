@@ -0,0 +1,25 @@
+from services.portfolio import SubscriberIndex
+
+
+def test_sync_only_counts_changed_users():
+    index = SubscriberIndex()
+    assert index.sync([{"a@x.com": {"p": ["NVDA", "AAPL"]}}, {"b@x.com": {"p": ["AAPL"]}}]) == 2
+    assert index.sync([{"a@x.com": {"p": ["AAPL", "NVDA"]}}, {"b@x.com": {"p": ["AAPL"]}}]) == 0
+    assert index.sync([{"a@x.com": {"p": ["NVDA"]}}]) == 2
+
+    assert index.tickers() == ["NVDA"]
+    assert index.subscribers(["NVDA"]) == {"a@x.com"}
+    assert index.subscribers(["AAPL"]) == set()
+
+
+def test_emails_excludes_users_without_tickers():
+    index = SubscriberIndex()
+    index.sync([
+        {"a@x.com": {"p": ["NVDA"]}},
+        {"empty@x.com": {}},
+        {"noacct@x.com": {"p": []}},
+    ])
+    assert index.emails() == {"a@x.com"}
+
+    index.sync([{"a@x.com": {"p": ["NVDA"]}}, {"empty@x.com": {"p": ["AAPL"]}}])
+    assert index.emails() == {"a@x.com", "empty@x.com"}
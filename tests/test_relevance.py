@@ -0,0 +1,74 @@
+from services.corpus import story_fingerprint
+from services.relevance import StoryIndex, company_aliases, load_aliases
+
+EMAILS = [
+    {"from": "Wire", "body": "NVIDIA shares rose after the chipmaker raised its data center forecast."},
+    {"from": "Desk", "body": "The Home Depot said same-store sales slipped as housing cooled."},
+    {"from": "Tape", "body": "$A jumped while I watched BRK.B and RY.TO drift lower."},
+    {"from": "Wire", "body": "Apple is exploring Google Gemini to power a revamped Siri."},
+]
+NAMES = {"NVDA": "NVIDIA Corporation", "HD": "The Home Depot, Inc.", "AAPL": "Apple Inc."}
+
+
+def test_company_aliases_drop_legal_suffixes():
+    assert company_aliases({"nvda": "NVIDIA Corporation"}) == {"NVDA": ["NVIDIA Corporation", "NVIDIA"]}
+    assert company_aliases({"HD": "The Home Depot, Inc."}) == {"HD": ["The Home Depot, Inc.", "Home Depot"]}
+    assert company_aliases({"GOOGL": "Alphabet Inc. Class A"})["GOOGL"][-1] == "Alphabet"
+    assert company_aliases({"X": "Acme"}) == {"X": ["Acme"]}
+
+
+def test_load_aliases_adds_database_names_to_built_ins():
+    aliases = load_aliases(NAMES, path=None)
+    assert aliases["NVDA"] == ["Nvidia", "NVIDIA Corporation", "NVIDIA"]
+    assert aliases["HD"] == ["The Home Depot, Inc.", "Home Depot"]
+    assert aliases["GOOG"] == ["Google", "Alphabet"]
+
+
+def test_match_by_symbol_alias_and_share_class():
+    index = StoryIndex(EMAILS, load_aliases(NAMES, path=None))
+    assert index.match(["NVDA"]) == [0]
+    assert index.match(["HD"]) == [1]
+    assert index.match(["BRK.B"]) == [2]
+    assert index.match(["RY.TO"]) == [2]
+    assert index.match(["GOOG", "AAPL"]) == [3]
+
+
+def test_single_letter_symbols_need_a_cashtag():
+    index = StoryIndex(EMAILS, aliases={})
+    assert index.match(["A"]) == [2]
+    assert index.match(["I"]) == []
+
+
+def test_unknown_company_name_does_not_match_without_alias():
+    index = StoryIndex(EMAILS, aliases={})
+    assert index.match(["HD"]) == []
+    assert index.tickers_by_story(["NVDA", "GOOG", "BRK.B"]) == {2: ["BRK.B"]}
+
+
+def test_select_prefers_excerpts_and_falls_back_to_full_story():
+    index = StoryIndex(EMAILS, load_aliases(NAMES, path=None))
+    excerpts = {0: {"NVDA": ["NVIDIA raised its forecast."]}, 3: {}}
+
+    assert index.select(["NVDA", "AAPL"], excerpts) == [
+        {"author": "Wire", "body": "NVIDIA raised its forecast.", "fingerprint": story_fingerprint(EMAILS[0]['body'])},
+    ]
+    assert index.select(["HD"], excerpts) == [
+        {"author": "Desk", "body": EMAILS[1]['body'], "fingerprint": story_fingerprint(EMAILS[1]['body'])},
+    ]
+    assert index.select(["HD"]) == index.select(["HD"], None)
+
+
+def test_selected_fingerprint_is_the_source_story_whatever_the_ticker_set():
+    index = StoryIndex([{"from": "Wire", "body": "Apple and Nvidia both rallied. Apple rose 2%. Nvidia rose 3%."}])
+    excerpts = {0: {"AAPL": ["Apple rose 2%."], "NVDA": ["Nvidia rose 3%."]}}
+    [apple] = index.select(["AAPL"], excerpts)
+    [both] = index.select(["AAPL", "NVDA"], excerpts)
+    assert apple['body'] != both['body']
+    assert apple['fingerprint'] == both['fingerprint']
+
+
+def test_corpus_carries_the_aliases_it_was_matched_with():
+    index = StoryIndex(EMAILS, load_aliases(NAMES, path=None))
+    rebuilt, excerpts = StoryIndex.from_corpus(index.to_corpus({0: {"NVDA": ["x"]}}))
+    assert rebuilt.match(["HD"]) == [1]
+    assert excerpts == {0: {"NVDA": ["x"]}}
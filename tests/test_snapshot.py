@@ -0,0 +1,89 @@
+import pytest
+
+from services import snapshot
+
+USERS = [{"a@example.com": {"Main": ["NVDA"]}}, {"b@example.com": {"Main": ["AAPL"]}}]
+
+
+@pytest.fixture
+def database(monkeypatch, tmp_path, clock):
+    """Portfolio tables behind load_portfolios(), counting the queries run against them."""
+    db = {"users": list(USERS), "watermark": ["1"], "watermark_queries": 0, "portfolio_queries": 0, "fail": False}
+
+    def fetch_watermark():
+        db["watermark_queries"] += 1
+        return db["watermark"]
+
+    def iter_portfolios(raise_errors=False):
+        db["portfolio_queries"] += 1
+        if db["fail"]:
+            raise ConnectionError("database unreachable")
+        return iter(db["users"])
+
+    monkeypatch.setattr(snapshot, "fetch_watermark", fetch_watermark)
+    monkeypatch.setattr(snapshot, "iter_portfolios", iter_portfolios)
+    monkeypatch.setattr(snapshot, "fetch_company_names", lambda: {"NVDA": "NVIDIA Corporation"})
+    monkeypatch.setattr(snapshot, "SNAPSHOT_URL", str(tmp_path / "portfolios.json.gz"))
+    monkeypatch.setattr(snapshot, "SNAPSHOT_CHECK_INTERVAL", 900)
+    monkeypatch.setattr(snapshot, "SNAPSHOT_MAX_AGE", 86400)
+    monkeypatch.setattr(snapshot, "_snapshot", None)
+    return db
+
+
+def cold_start(monkeypatch):
+    monkeypatch.setattr(snapshot, "_snapshot", None)
+
+
+def test_cold_instance_loads_persisted_snapshot_without_querying(database, monkeypatch):
+    assert snapshot.load_portfolios() == USERS
+    assert database["portfolio_queries"] == 1
+
+    cold_start(monkeypatch)
+    assert snapshot.load_portfolios() == USERS
+    assert snapshot.load_company_names() == {"NVDA": "NVIDIA Corporation"}
+    assert database["portfolio_queries"] == 1
+    assert database["watermark_queries"] == 1
+
+
+def test_snapshot_is_rebuilt_only_when_the_watermark_moves(database, clock):
+    snapshot.load_portfolios()
+    clock[0] += 901
+    assert snapshot.load_portfolios() == USERS
+    assert (database["watermark_queries"], database["portfolio_queries"]) == (2, 1)
+
+    database["users"] = USERS[:1]
+    database["watermark"] = ["2"]
+    clock[0] += 901
+    assert snapshot.load_portfolios() == USERS[:1]
+    assert database["portfolio_queries"] == 2
+
+
+def test_snapshot_without_watermark_is_not_persisted(database, monkeypatch, clock):
+    database["watermark"] = None
+    snapshot.load_portfolios()
+
+    cold_start(monkeypatch)
+    snapshot.load_portfolios()
+    assert database["portfolio_queries"] == 2
+
+
+def test_failed_refresh_falls_back_to_previous_snapshot(database, clock):
+    assert snapshot.load_portfolios() == USERS
+    database["watermark"] = ["2"]
+    database["fail"] = True
+    clock[0] += 901
+    assert snapshot.load_portfolios() == USERS
+
+
+def test_failed_refresh_without_snapshot_returns_nothing(database):
+    database["fail"] = True
+    assert snapshot.load_portfolios() == []
+
+
+def test_invalidate_forces_a_rebuild(database, monkeypatch):
+    snapshot.load_portfolios()
+    snapshot.invalidate_snapshot()
+
+    cold_start(monkeypatch)
+    snapshot.load_portfolios()
+    assert database["portfolio_queries"] == 2
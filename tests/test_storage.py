@@ -0,0 +1,83 @@
+import pytest
+from google.api_core.exceptions import NotFound
+
+from services import storage
+
+
+class FakeBlob:
+    def __init__(self, objects, calls, name):
+        self.objects = objects
+        self.calls = calls
+        self.name = name
+
+    def download_as_bytes(self):
+        self.calls.append(("download", self.name))
+        if self.name not in self.objects:
+            raise NotFound(self.name)
+        return self.objects[self.name]
+
+    def upload_from_string(self, data, content_type=None):
+        self.calls.append(("upload", self.name))
+        self.objects[self.name] = data
+
+    def exists(self):
+        self.calls.append(("exists", self.name))
+        return self.name in self.objects
+
+
+class FakeBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def blob(self, name):
+        return FakeBlob(self.client.objects, self.client.calls, f"{self.name}/{name}")
+
+
+class FakeClient:
+    """Cloud Storage client holding objects in a dict and recording every call."""
+
+    def __init__(self):
+        self.objects = {}
+        self.calls = []
+
+    def bucket(self, name):
+        return FakeBucket(self, name)
+
+
+@pytest.fixture
+def gcs(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(storage, "_client", client)
+    return client
+
+
+def test_gcs_objects_take_one_call_each(gcs):
+    assert storage.read_object("gs://bucket/ledger/missing") is None
+    storage.write_object("gs://bucket/ledger/run/delivered", b"1")
+    assert storage.read_object("gs://bucket/ledger/run/delivered") == b"1"
+    assert gcs.calls == [
+        ("download", "bucket/ledger/missing"),
+        ("upload", "bucket/ledger/run/delivered"),
+        ("download", "bucket/ledger/run/delivered"),
+    ]
+
+
+def test_gcs_content_store_uses_the_shared_client(gcs):
+    store = storage.get_content_store("gs://bucket/corpus")
+    key = store.put(b"stories")
+    assert store.put(b"stories") == key
+    assert store.get(key) == b"stories"
+    assert [call for call, _ in gcs.calls].count("upload") == 1
+
+
+def test_local_objects_and_content_store(tmp_path):
+    url = f"file://{tmp_path}/snapshots/portfolios.json"
+    assert storage.read_object(url) is None
+    storage.write_object(url, b"[]")
+    assert storage.read_object(url) == b"[]"
+
+    store = storage.get_content_store(str(tmp_path / "content"))
+    key = store.put(b"stories")
+    assert store.get(key) == b"stories"
+    assert storage.get_content_store(None) is None
@@ -0,0 +1,71 @@
+import pytest
+
+from services import tasks
+from services.tasks import InMemoryDispatcher, payload_emails
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(tasks.time, "sleep", lambda seconds: None)
+
+
+def payloads(count, run_id="run"):
+    return [{"run_id": run_id, "jobs": [{"emails": [f"user{i}@example.com"], "tickers": ["NVDA"]}]} for i in range(count)]
+
+
+class LostResponseDispatcher(InMemoryDispatcher):
+    """Creates every task on the first attempt but reports it as failed, like a timed-out call."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.attempts = []
+
+    def _create_task(self, payload, task_id=None):
+        self.attempts.append(task_id)
+        name = super()._create_task(payload, task_id)
+        if self.attempts.count(task_id) == 1:
+            raise TimeoutError("deadline exceeded")
+        return name
+
+
+class FailingDispatcher(InMemoryDispatcher):
+    """Never manages to create the task for the given recipient."""
+
+    def __init__(self, email, **kwargs):
+        super().__init__(**kwargs)
+        self.email = email
+
+    def _create_task(self, payload, task_id=None):
+        if self.email in payload_emails(payload):
+            raise ConnectionError("queue unavailable")
+        return super()._create_task(payload, task_id)
+
+
+def test_in_memory_dispatcher_keeps_every_payload():
+    dispatcher = InMemoryDispatcher()
+    report = dispatcher.dispatch(payloads(3))
+    assert report["created"] == 3
+    assert report["failed"] == []
+    assert sorted(payload_emails(task)[0] for task in dispatcher.tasks) == ["user0@example.com", "user1@example.com", "user2@example.com"]
+
+
+def test_retried_create_does_not_duplicate_the_task():
+    dispatcher = LostResponseDispatcher()
+    report = dispatcher.dispatch(payloads(2))
+    assert report["created"] == 2
+    assert sorted(dispatcher.attempts) == ["run-0", "run-0", "run-1", "run-1"]
+    assert len(dispatcher.tasks) == 2
+
+
+def test_failed_tasks_are_reported_with_their_recipients():
+    dispatcher = FailingDispatcher("user1@example.com", max_retries=2)
+    report = dispatcher.dispatch(payloads(3))
+    assert report["created"] == 2
+    assert report["failed"] == [{"index": 1, "emails": ["user1@example.com"], "error": "queue unavailable"}]
+
+
+def test_payloads_without_run_id_get_anonymous_tasks():
+    dispatcher = InMemoryDispatcher()
+    assert tasks.task_id({"emails": ["a@example.com"]}, 0) is None
+    dispatcher.dispatch(payloads(2, run_id=None))
+    assert len(dispatcher.tasks) == 2
@@ -0,0 +1,38 @@
+import asyncio
+import threading
+
+_loop = None
+_lock = threading.Lock()
+
+
+def get_event_loop():
+    """
+    Return the process-wide event loop, starting it on a daemon thread on first use.
+
+    Flask routes are synchronous, so rather than spinning up a fresh loop per
+    request with asyncio.run, every request submits its coroutine to this one
+    long-lived loop. Clients bound to the loop (pooled HTTP connections,
+    semaphores) are then shared by every in-flight newsletter.
+
+    Returns:
+        asyncio.AbstractEventLoop: The running background loop
+    """
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="event-loop", daemon=True).start()
+    return _loop
+
+
+def run(coro):
+    """
+    Run a coroutine on the process-wide loop and block until it finishes.
+
+    Args:
+        coro (coroutine): Coroutine to run
+
+    Returns:
+        The coroutine's result
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
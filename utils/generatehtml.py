@@ -0,0 +1,109 @@
+import html
+import re
+
+HEADER_PATTERN = re.compile(r'^##\s+')
+BOLD_PATTERN = re.compile(r'\*\*(.+?)\*\*')
+ITALIC_PATTERN = re.compile(r'(?<![*\w])\*(?!\s)(.+?)(?<!\s)\*(?![*\w])')
+
+# Colors and fonts of the PDF banner drawn by utils.generatepdf.draw_banner
+GOLD = "#FAE100"
+SERIF = "'Times New Roman', Times, serif"
+
+BANNER_HTML = (
+    '<table role="presentation" width="100%" cellpadding="0" cellspacing="0" border="0" '
+    'style="background:#000000;border-bottom:2px solid {gold};">'
+    '<tr><td style="padding:28px 24px 8px 24px;font-family:{serif};font-size:36px;line-height:40px;">'
+    '<span style="color:{gold};font-weight:bold;font-style:italic;">dUW</span> '
+    '<span style="color:#ffffff;">Diligence</span>'
+    '</td></tr>'
+    '{title_row}'
+    '</table>'
+)
+TITLE_ROW_HTML = (
+    '<tr><td align="center" style="padding:12px 24px 24px 24px;font-family:{serif};'
+    'font-size:18px;line-height:24px;color:#ffffff;">{title}</td></tr>'
+)
+# Body fonts are set once on the wrapper and inherited, to keep each block's markup short
+HEADER_HTML = '<h2 style="font-size:16pt;line-height:20pt;margin:16pt 0;">{text}</h2>'
+PARAGRAPH_HTML = '<p style="margin:0 0 24pt 0;">{text}</p>'
+DOCUMENT_HTML = (
+    '<!DOCTYPE html><html><head><meta charset="utf-8">'
+    '<meta name="viewport" content="width=device-width, initial-scale=1"><title>{title}</title></head>'
+    '<body style="margin:0;padding:0;background:#ffffff;">'
+    '<div style="max-width:640px;margin:0 auto;">{banner}'
+    '<div style="padding:8px 24px 24px 24px;font-family:{serif};font-size:12pt;line-height:16pt;color:#000000;">{body}</div>'
+    '</div></body></html>'
+)
+
+
+def inline_markup(text):
+    """
+    Escape text for HTML and turn markdown **bold** and *italic* into tags.
+    """
+    text = html.escape(text, quote=False)
+    text = BOLD_PATTERN.sub(r'<strong>\1</strong>', text)
+    return ITALIC_PATTERN.sub(r'<em>\1</em>', text)
+
+
+def parse_blocks(newsletter_body):
+    """
+    Split a markdown body into ("header" | "paragraph", text) blocks, with the
+    same rules build_flowables uses for the PDF.
+
+    Args:
+        newsletter_body (str): Markdown body from the LLM
+
+    Returns:
+        list: (kind, text) tuples in order
+    """
+    blocks = []
+    current_paragraph = []
+
+    def flush():
+        paragraph_text = ' '.join(current_paragraph).strip()
+        if paragraph_text:
+            blocks.append(("paragraph", paragraph_text))
+        current_paragraph.clear()
+
+    for line in (newsletter_body or '').split('\n'):
+        line = line.strip()
+        if HEADER_PATTERN.match(line):
+            flush()
+            blocks.append(("header", HEADER_PATTERN.sub('', line)))
+        elif not line:
+            flush()
+        else:
+            current_paragraph.append(line)
+    flush()
+    return blocks
+
+
+def render_html(data):
+    """
+    Render a newsletter to an inline-styled HTML email and its plain-text alternative.
+
+    Args:
+        data (dict): Newsletter with "title" and markdown "body"
+
+    Returns:
+        tuple: (html, text) strings
+    """
+    title = data.get("title", "")
+    blocks = parse_blocks(data.get("body", "")) or [("paragraph", "No relevant stories found.")]
+
+    body = ''.join(
+        (HEADER_HTML if kind == "header" else PARAGRAPH_HTML).format(text=inline_markup(text))
+        for kind, text in blocks
+    )
+    title_row = TITLE_ROW_HTML.format(serif=SERIF, title=html.escape(title)) if title else ''
+    banner = BANNER_HTML.format(gold=GOLD, serif=SERIF, title_row=title_row)
+    document = DOCUMENT_HTML.format(title=html.escape(title or "dUW Diligence"), banner=banner, body=body, serif=SERIF)
+
+    lines = ["dUW Diligence"]
+    if title:
+        lines.append(title)
+    lines.append('')
+    for kind, text in blocks:
+        lines.append(text.upper() if kind == "header" else text)
+        lines.append('')
+    return document, '\n'.join(lines).strip() + '\n'
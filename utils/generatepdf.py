@@ -1,29 +1,79 @@
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
 from reportlab.lib.pagesizes import LETTER
 from reportlab.lib.colors import black, white, HexColor
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Frame, PageTemplate
-from reportlab.pdfgen import canvas
-import re
 
-def draw_header(canvas, doc, newsletter_title=""):
-    width, height = LETTER
+PDF_RENDER_PROCESSES = int(os.environ.get("PDF_RENDER_PROCESSES", "0")) or None
+
+WIDTH, HEIGHT = LETTER
+MARGIN = 72
+USABLE_HEIGHT = HEIGHT - 240
+GOLD = HexColor("#FAE100")
+BANNER_FORM = "duw-banner"
+
+HEADER_PATTERN = re.compile(r'^##\s+')
+
+# Styles never change between newsletters, so build them once per process
+_styles = getSampleStyleSheet()
+
+BODY_STYLE = ParagraphStyle(
+    'Story',
+    parent=_styles['Normal'],
+    fontName='Times-Roman',
+    fontSize=12,
+    leading=16,
+    spaceAfter=12,
+    textColor=black,
+)
+
+# Header style for markdown headers
+HEADER_STYLE = ParagraphStyle(
+    'Header',
+    parent=_styles['Normal'],
+    fontName='Times-Bold',
+    fontSize=16,
+    leading=20,
+    spaceAfter=16,
+    spaceBefore=16,
+    textColor=black,
+)
+
+_render_pool = None
+
+def draw_banner(canvas):
+    width, height = WIDTH, HEIGHT
     # Draw black rectangle (extended to accommodate newsletter title)
     canvas.setFillColor(black)
     canvas.rect(0, height - 160, width, 160, fill=1, stroke=0)
 
     # Draw gold line
-    gold = HexColor("#FAE100")
-    canvas.setFillColor(gold)
+    canvas.setFillColor(GOLD)
     canvas.rect(0, height - 162, width, 2, fill=1, stroke=0)
 
     # Write title "dUW Diligence"
     canvas.setFont("Times-BoldItalic", 36)
-    canvas.setFillColor(gold)
+    canvas.setFillColor(GOLD)
     canvas.drawString(72, height - 80, "dUW")
 
     canvas.setFont("Times-Roman", 36)
     canvas.setFillColor(white)
     canvas.drawString(150, height - 80, "Diligence")
+
+def draw_header(canvas, doc, newsletter_title=""):
+    width, height = WIDTH, HEIGHT
+    # The banner is identical on every page, so draw it once per document as a
+    # form XObject and reference it from each page instead of redrawing it
+    if not getattr(canvas, '_duw_banner_defined', False):
+        canvas.beginForm(BANNER_FORM)
+        draw_banner(canvas)
+        canvas.endForm()
+        canvas._duw_banner_defined = True
+    canvas.doForm(BANNER_FORM)
     
     # Add newsletter title below "dUW Diligence" if provided
     if newsletter_title:
@@ -34,39 +84,10 @@ def draw_header(canvas, doc, newsletter_title=""):
         x_position = (width - text_width) / 2
         canvas.drawString(x_position, height - 130, newsletter_title)
 
-def generate_pdf(data, filename="newsletter.pdf"):
-    width, height = LETTER
-    margin = 72
-    usable_height = height - 240
-    styles = getSampleStyleSheet()
-    
-    # Create body style
-    body_style = ParagraphStyle(
-        'Story',
-        parent=styles['Normal'],
-        fontName='Times-Roman',
-        fontSize=12,
-        leading=16,
-        spaceAfter=12,
-        textColor=black,
-    )
-    
-    # Create header style for markdown headers
-    header_style = ParagraphStyle(
-        'Header',
-        parent=styles['Normal'],
-        fontName='Times-Bold',
-        fontSize=16,
-        leading=20,
-        spaceAfter=16,
-        spaceBefore=16,
-        textColor=black,
-    )
+def on_page(canvas, doc):
+    draw_header(canvas, doc, doc.newsletter_title)
 
-    # Extract title and body from the new data format
-    newsletter_title = data.get("title", "")
-    newsletter_body = data.get("body", "")
-    
+def build_flowables(newsletter_body):
     # Create the story flowables with markdown header support
     story_flowables = []
     if newsletter_body:
@@ -78,25 +99,25 @@ def generate_pdf(data, filename="newsletter.pdf"):
             line = line.strip()
             
             # If we encounter a header line
-            if re.match(r'^##\s+', line):
+            if HEADER_PATTERN.match(line):
                 # First, add any accumulated paragraph content
                 if current_paragraph:
                     paragraph_text = ' '.join(current_paragraph).strip()
                     if paragraph_text:
-                        story_flowables.append(Paragraph(paragraph_text, body_style))
+                        story_flowables.append(Paragraph(paragraph_text, BODY_STYLE))
                         story_flowables.append(Spacer(1, 12))
                     current_paragraph = []
                 
                 # Add the header
-                header_text = re.sub(r'^##\s+', '', line)
-                story_flowables.append(Paragraph(header_text, header_style))
+                header_text = HEADER_PATTERN.sub('', line)
+                story_flowables.append(Paragraph(header_text, HEADER_STYLE))
                 
             # If it's an empty line, treat it as paragraph break
             elif not line:
                 if current_paragraph:
                     paragraph_text = ' '.join(current_paragraph).strip()
                     if paragraph_text:
-                        story_flowables.append(Paragraph(paragraph_text, body_style))
+                        story_flowables.append(Paragraph(paragraph_text, BODY_STYLE))
                         story_flowables.append(Spacer(1, 12))
                     current_paragraph = []
                     
@@ -108,26 +129,104 @@ def generate_pdf(data, filename="newsletter.pdf"):
         if current_paragraph:
             paragraph_text = ' '.join(current_paragraph).strip()
             if paragraph_text:
-                story_flowables.append(Paragraph(paragraph_text, body_style))
+                story_flowables.append(Paragraph(paragraph_text, BODY_STYLE))
                 story_flowables.append(Spacer(1, 12))
                 
     else:
         # If no body content, add a placeholder
-        story_flowables.append(Paragraph("No relevant stories found.", body_style))
+        story_flowables.append(Paragraph("No relevant stories found.", BODY_STYLE))
+    return story_flowables
 
-    def on_page(canvas, doc):
-        draw_header(canvas, doc, newsletter_title)
+def generate_pdf(data, filename="newsletter.pdf"):
+    """
+    Render a newsletter to a PDF.
 
-    frame = Frame(margin, margin, width - 2*margin, usable_height, showBoundary=0)
+    Args:
+        data (dict): Newsletter with "title" and markdown "body"
+        filename (str or file-like): Path to write, or a writable binary buffer
+    """
+    # Extract title and body from the new data format
+    story_flowables = build_flowables(data.get("body", ""))
+
+    # Frames carry layout state while a document builds, so each document gets its own
+    frame = Frame(MARGIN, MARGIN, WIDTH - 2*MARGIN, USABLE_HEIGHT, showBoundary=0)
     template = PageTemplate(id='headered', frames=frame, onPage=on_page)
-    doc = SimpleDocTemplate(filename, pagesize=LETTER, leftMargin=margin, rightMargin=margin, topMargin=margin, bottomMargin=margin)
+    doc = SimpleDocTemplate(filename, pagesize=LETTER, leftMargin=MARGIN, rightMargin=MARGIN, topMargin=MARGIN, bottomMargin=MARGIN)
+    doc.newsletter_title = data.get("title", "")
     doc.addPageTemplates([template])
     doc.build(story_flowables)
 
 
-if __name__ == '__main__':
-    data = {
+def render_pdf(data):
+    """
+    Render a newsletter to PDF bytes in memory, without touching the filesystem.
+
+    Args:
+        data (dict): Newsletter with "title" and markdown "body"
+
+    Returns:
+        bytes: The rendered PDF
+    """
+    buffer = BytesIO()
+    generate_pdf(data, buffer)
+    return buffer.getvalue()
+
+
+def get_render_pool():
+    """
+    Return the process pool used for rendering, starting it on first use.
+
+    Sized by PDF_RENDER_PROCESSES, or one process per CPU when unset.
+
+    Returns:
+        ProcessPoolExecutor: Shared render pool
+    """
+    global _render_pool
+    if _render_pool is None:
+        # The server is multi-threaded by the time the first render happens, and
+        # forking a threaded process can deadlock, so start workers from a clean one
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _render_pool = ProcessPoolExecutor(max_workers=PDF_RENDER_PROCESSES, mp_context=multiprocessing.get_context(method))
+    return _render_pool
+
+
+def submit_render(letter):
+    """
+    Render one newsletter on the render pool, so concurrent renders in a
+    worker run in parallel instead of queueing on the GIL.
+
+    Args:
+        letter (dict): Newsletter with "title" and markdown "body"
+
+    Returns:
+        concurrent.futures.Future: Resolves to the rendered PDF bytes
+    """
+    return get_render_pool().submit(render_pdf, letter)
+
+
+def render_pdfs(letters):
+    """
+    Render many newsletters in parallel across the render pool.
+
+    ReportLab layout is CPU-bound and holds the GIL, so threads cannot render
+    in parallel; separate processes can.
+
+    Args:
+        letters (list): Newsletters with "title" and markdown "body"
+
+    Returns:
+        list: Rendered PDF bytes, in the same order as letters
+    """
+    if len(letters) < 2:
+        return [render_pdf(letter) for letter in letters]
+    return list(get_render_pool().map(render_pdf, letters))
+
+
+SAMPLE_NEWSLETTER = {
     "title": "Powell Signals Rate Cut Amid AI and Tech Sector Volatility",
     "body": "## WSJ Markets Effect VOOG\nAccording to WSJ Markets P.M., Jerome Powell's speech in Jackson Hole raised hopes for interest rate cuts and drove stocks higher on Friday. The rally reversed what had been a rough week for markets, and particularly tech stocks. According to FT Briefing, the sell-off provides a reminder of the risks of the tech sector’s dominance in public and private markets. According to Bloomberg, Fed Chair Jerome Powell was in Jackson Hole explaining why rising unemployment means a policy adjustment may be in the cards, a comment that instantly turbocharged markets.\n\n## NVDA soaring\nAccording to Bloomberg, Nvidia told its suppliers Samsung and Amkor to stop production related to its H20 AI chip after Beijing urged local firms to avoid using it. In other news, Bloomberg also reported that the market cap of Nvidia alone -- $4.3 trillion -- is larger than the GDP of the UK, France, or Italy. Looking ahead, WSJ Markets P.M. notes that Nvidia is set to post its fiscal second-quarter report on Wednesday afternoon.\n\nMETA GOOG\nAccording to Bloomberg, Meta agreed to a deal worth at least $10 billion with Google for cloud computing services, according to people familiar.\n\nMETA\nAccording to FT Briefing, Meta is set to license AI technology from start-up Midjourney as its in-house models lag rivals, a partnership that marks a shift away from internal product development.\n\n## GOOG not doing well\nAccording to Bloomberg, Apple is exploring using Google Gemini AI to power a revamped Siri. Separately, according to WSJ The Future of Everything, Google’s new Pixel 10 is chock-full of useful AI tools.\n\nAMZN\nAccording to WSJ Politics & Policy, major retailers are thriving in the tariff economy. Walmart, Amazon and the owner of T.J. Maxx are scooping up market share from rivals by offering shoppers good deals and convenience. Additionally, WSJ The Future of Everything reports that cybercriminals are using AI to create high-quality fake websites, imitating well-known retailers such as Amazon.\n\nRY TD\nAccording to Bloomberg, the outlook for Canadian banks isn’t all that bad as the country’s big lenders head into reporting season. The Big Six — Royal Bank of Canada, Toronto-Dominion Bank, Bank of Nova Scotia, Bank of Montreal, Canadian Imperial Bank of Commerce and National Bank of Canada — have seen a run-up in their share prices since they last reported in the spring. The S&P/TSX banks index is now up more than 14% this year. The biggest member, RBC, hit another record on Thursday. Earnings reports are expected next week, with RBC reporting on Wednesday and Toronto-Dominion on Thursday.\n\nBTC\nAccording to FT Briefing, the EU is speeding up plans for a digital euro after a US stablecoin law. The news raises the possibility of a digital currency using a public rather than private blockchain. On a related note, an FT Briefing opinion piece titled \"Gold diggers follow the money\" notes that the danger with gold rushes is turning up too late, and previous bouts of outperformance have typically been reversed, a sentiment that could be applied to other alternative assets."
-    } 
-    generate_pdf(data)
+}
+
+
+if __name__ == '__main__':
+    generate_pdf(SAMPLE_NEWSLETTER)
@@ -0,0 +1,196 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Environment variables
+METRICS_JSON_LOGS = os.environ.get("METRICS_JSON_LOGS", "false").lower() == "true"
+
+# Upper bounds for histogram buckets
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTES_BUCKETS = (1e3, 1e4, 5e4, 1e5, 5e5, 1e6, 5e6, 1e7)
+
+# Raw samples kept per histogram series, for percentiles in benchmarks
+MAX_SAMPLES = 10000
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_help = {}
+
+
+def _series(name, labels):
+    return name, tuple(sorted((labels or {}).items()))
+
+
+def describe(name, help_text):
+    """
+    Attach a HELP line to a metric in the Prometheus output.
+    """
+    _help[name] = help_text
+
+
+def inc(name, value=1, labels=None):
+    """
+    Increment a counter.
+
+    Args:
+        name (str): Metric name
+        value (float): Amount to add
+        labels (dict): Optional label values
+    """
+    key = _series(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, labels=None, buckets=SECONDS_BUCKETS):
+    """
+    Record a value in a histogram.
+
+    Args:
+        name (str): Metric name
+        value (float): Observed value
+        labels (dict): Optional label values
+        buckets (tuple): Bucket upper bounds, fixed by the first observation of a series
+    """
+    key = _series(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0, "samples": []}
+        for i, bound in enumerate(histogram["buckets"]):
+            if value <= bound:
+                histogram["counts"][i] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+        if len(histogram["samples"]) < MAX_SAMPLES:
+            histogram["samples"].append(value)
+
+
+@contextmanager
+def span(stage, **fields):
+    """
+    Time a pipeline stage into the stage_seconds histogram.
+
+    Failures are timed too, and counted in stage_errors_total. With
+    METRICS_JSON_LOGS enabled, each span is also logged as one JSON line.
+
+    Args:
+        stage (str): Stage name, e.g. "call_llm"
+        **fields: Extra context for the JSON log line, such as recipient counts
+    """
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        inc("stage_errors_total", labels={"stage": stage})
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        observe("stage_seconds", seconds, labels={"stage": stage})
+        if METRICS_JSON_LOGS:
+            logger.info(json.dumps({"span": stage, "seconds": round(seconds, 4), "status": status, **fields}))
+
+
+def samples(name, labels=None):
+    """
+    Raw observations of a histogram series, oldest first.
+
+    Returns:
+        list: Recorded values, capped at MAX_SAMPLES
+    """
+    with _lock:
+        histogram = _histograms.get(_series(name, labels))
+        return list(histogram["samples"]) if histogram else []
+
+
+def total(name, labels=None):
+    """
+    Sum of a counter across every series whose labels include the given ones.
+
+    Returns:
+        float: Counter total, 0 if never incremented
+    """
+    wanted = set((labels or {}).items())
+    with _lock:
+        return sum(value for (series, series_labels), value in _counters.items() if series == name and wanted <= set(series_labels))
+
+
+def reset():
+    """
+    Clear every metric.
+    """
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def render_prometheus():
+    """
+    Render every metric in the Prometheus text exposition format.
+
+    Returns:
+        str: Exposition text
+    """
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted(_histograms.items())
+        histograms = [(key, {**value, "counts": list(value["counts"])}) for key, value in histograms]
+
+    typed = set()
+    for (name, labels), value in counters:
+        if name not in typed:
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for (name, labels), histogram in histograms:
+        if name not in typed:
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        for bound, count in zip(histogram["buckets"], histogram["counts"]):
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+
+    return "\n".join(lines) + "\n"
+
+
+describe("stage_seconds", "Wall time of each pipeline stage.")
+describe("stage_errors_total", "Pipeline stages that raised.")
+describe("llm_requests_total", "LLM completion requests, by model and outcome.")
+describe("llm_retries_total", "LLM completion attempts that were retried.")
+describe("llm_backoff_seconds_total", "Time spent sleeping between LLM retries.")
+describe("llm_queue_seconds", "Time LLM requests waited for the rate limiter and a concurrency slot.")
+describe("llm_cache_requests_total", "LLM completion cache lookups, by kind and hit or miss.")
+describe("llm_tokens_total", "Tokens reported in completion usage, by model and kind.")
+describe("task_payload_bytes", "Size of each enqueued worker task body.")
+describe("pdf_bytes", "Size of each rendered newsletter PDF.")
+describe("html_bytes", "Size of each rendered HTML newsletter.")
+describe("newsletters_skipped_total", "Recipients not sent a newsletter, by reason.")
+describe("emails_sent_total", "Newsletter emails, by outcome.")